@@ -0,0 +1,225 @@
+from lib import np, pd, os, json, time
+from lib.synthetic import write_day, make_sntl_dataset
+from lib.file_reader import FileReader
+from lib.utilities import hourly_swe_to_rate, reduce_sat_df
+from lib.statistics import Statistics
+import collocation
+import argparse, copy, platform, subprocess, sys, tempfile
+
+"""
+Input:
+    Scales to run, number of repeats
+    Optional previous results to compare against
+
+Output:
+    Best and mean time of every benchmark at every scale as json
+    Import time of the statistics and data model modules against a budget
+
+Idea:
+    Generate synthetic granules (lib.synthetic) and snotel data of
+    increasing size, then time the hot paths of the pipeline on them: reading
+    each granule layout, collocation, reducing collocated frames, daily
+    accumulation and the statistics. Results of two runs can be compared to
+    catch regressions
+
+Usage:
+    python benchmark.py --scales small medium --output bench.json
+    python benchmark.py --scales small --compare bench.json
+    python benchmark.py --scales --import-budget 0.5
+"""
+
+CENTER = (-150, 65)
+SCALES = {  # snotel sites, days of granules
+    "small": (20, 1),
+    "medium": (100, 2),
+    "large": (400, 4),
+}
+# Modules that are imported by short jobs and workers, they must not pull in
+# the file formats or plotting stacks
+IMPORT_MODULES = ("lib.statistics", "lib.snotel_data", "lib.instrumentation")
+HEAVY_MODULES = ("xarray", "h5py", "matplotlib", "cartopy")
+
+
+def build_data(folder: str, scale: str) -> dict:
+    """
+    Writes the granules of every layout for a scale into folder and returns
+    the date range and snotel data
+    """
+    n_sites, n_days = SCALES[scale]
+    days = np.arange(np.datetime64("2022-01-17"), np.datetime64("2022-01-17") + n_days)
+    date_range = [str(days[0]), str(days[-1])]
+
+    for layout in ("tiny", "normal", "orbit"):
+        if not os.path.exists(os.path.join(folder, layout)):
+            for i, day in enumerate(days):
+                write_day(os.path.join(folder, layout), layout, str(day), CENTER, seed=i * 1000)
+
+    sntl = make_sntl_dataset(n_sites, date_range, CENTER)
+    hourly_swe_to_rate(sntl, "precip_accum_set_1", "hourly", True)
+
+    return {"date_range": date_range, "sntl": sntl}
+
+
+def time_call(fn, repeats: int, setup=None) -> dict:
+    """
+    Times fn repeats times, setup is called before every call and its result
+    is passed to fn so setup cost is not timed
+    """
+    times = []
+
+    for _ in range(repeats):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(arg) if setup is not None else fn()
+        times.append(time.perf_counter() - start)
+
+    return {"best": min(times), "mean": float(np.mean(times)), "repeats": repeats}
+
+
+def time_import(module: str, repeats: int) -> dict:
+    """
+    Times importing module in a fresh interpreter repeats times and records
+    which heavy modules it loaded
+    """
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "seconds = time.perf_counter() - start\n"
+            f"print(json.dumps([seconds, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))")
+    times = []
+
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        seconds, heavy = json.loads(out.stdout.splitlines()[-1])
+        times.append(seconds)
+
+    return {"best": min(times), "mean": float(np.mean(times)), "repeats": repeats, "heavy": heavy}
+
+
+def run_imports(repeats: int, budget: float) -> tuple[dict, list[str]]:
+    """
+    Import time of every IMPORT_MODULES entry. Returns the results and the
+    modules over budget seconds or loading a heavy module
+    """
+    results, violations = {}, []
+
+    for module in IMPORT_MODULES:
+        results[f"import[{module}]"] = result = time_import(module, repeats)
+        flag = ""
+        if result["best"] > budget or len(result["heavy"]) != 0:
+            flag = f"OVER BUDGET {result['heavy'] or ''}"
+            violations.append(module)
+        print(f"{'imports':>8} {module:<28} {result['best']:.4f} s {flag}")
+
+    return results, violations
+
+
+def run_scale(folder: str, scale: str, repeats: int) -> dict:
+    data = build_data(folder, scale)
+    sntl, date_range = data["sntl"], data["date_range"]
+    results = {}
+
+    def record(name, fn, setup=None):
+        results[name] = time_call(fn, repeats, setup)
+        print(f"{scale:>8} {name:<28} {results[name]['best']:.4f} s")
+
+    for layout in ("tiny", "normal", "orbit"):
+        record(f"read_all[{layout}]",
+               lambda: FileReader.read_all(os.path.join(folder, layout), CENTER, date_range))
+
+    swaths = FileReader.read_all(os.path.join(folder, "normal"), CENTER, date_range)
+    collocation.BOX_LEN_KM = 50
+    collocation.TIME_DELAY = [0, 120]
+    record("collocate", lambda: collocation.collocate_multiple(sntl, swaths, sat_name="synthetic"))
+
+    coll = collocation.collocate_multiple(sntl, swaths, sat_name="synthetic")
+    sats = [sat for _, site in coll for sat in site.sat]
+    record("reduce_sat_df", lambda frames: [reduce_sat_df(frame, CENTER[0], CENTER[1]) for frame in frames],
+           lambda: [frame.copy() for frame in sats])
+    record("accumulate_daily", lambda: collocation.accumulate_daily(sats))
+
+    stats = Statistics("hourly_precip_accum_set_1", "air_temp_set_1")
+    record("process_collocated_data", lambda c: stats.process_collocated_data(c), lambda: copy.deepcopy(coll))
+
+    stats.process_collocated_data(coll)
+    record("bias", lambda: stats.bias(coll))
+    record("correlation", lambda: stats.correlation(coll))
+    record("rmse", lambda: stats.rmse(coll))
+    record("confusion_matrix", lambda: stats.confusion_matrix(coll))
+    record("threshold_sweep", lambda: stats.threshold_sweep(coll))
+    record("bootstrap[1000]", lambda: stats.bootstrap(coll, 1000, seed=0))
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Prints the time ratio of every benchmark against baseline. Returns the
+    benchmarks that are slower than 1 + tolerance times the baseline
+    """
+    regressions = []
+
+    for scale, benches in results["results"].items():
+        for name, result in benches.items():
+            old = baseline["results"].get(scale, {}).get(name)
+            if old is None:
+                continue
+
+            ratio = result["best"] / old["best"]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "REGRESSION"
+                regressions.append(f"{scale}/{name}")
+            print(f"{scale:>8} {name:<28} {old['best']:.4f} -> {result['best']:.4f} s  x{ratio:.2f} {flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline hot paths on synthetic data")
+    parser.add_argument("--scales", nargs="*", default=["small"], choices=list(SCALES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--data", default=None, help="folder for the synthetic data, reused if it exists")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", default=None, help="previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a regression")
+    parser.add_argument("--import-budget", type=float, default=1.0,
+                        help="seconds the statistics and data model modules may take to import")
+    args = parser.parse_args()
+
+    data = args.data if args.data is not None else tempfile.mkdtemp(prefix="sfr_benchmark_")
+    results = {
+        "meta": {
+            "time": str(np.datetime64("now")),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.platform(),
+        },
+        "results": {},
+    }
+
+    results["results"]["imports"], violations = run_imports(args.repeats, args.import_budget)
+
+    for scale in args.scales:
+        results["results"][scale] = run_scale(os.path.join(data, scale), scale, args.repeats)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    if len(violations) != 0:
+        print(f"Over import budget: {violations}")
+    if len(regressions) != 0:
+        print(f"Regressions: {regressions}")
+    if len(violations) != 0 or len(regressions) != 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
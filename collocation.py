@@ -1,8 +1,17 @@
 from lib import pd, np, time, os, pickle, json
 from lib.snotel_data import *
-from lib.utilities import hourly_swe_to_rate
+from lib.utilities import hourly_swe_to_rate, km_to_deg
 from lib.file_reader import FileReader
-from lib.statistics import Statistics
+from lib.sensors import Sensor, register_sensor
+from lib.dedup import PixelDeduplicator
+from lib.statistics import Statistics, StatisticsAccumulator
+from lib.partitions import PartitionStore
+from lib.instrumentation import metrics
+from lib import LazyModule
+import shutil, sys
+
+# Only imported by the "radius" mode
+spatial = LazyModule("scipy.spatial")
 
 """
 Input: 
@@ -21,9 +30,14 @@ Idea:
     area around each snotel station
 """
 
+# "box" or "radius", set from the config in main
+COLLOCATION_MODE = "box"
+EARTH_RADIUS_KM = 6371
+
 
 def collocate_multiple(
-    sntl: SnotelDataset, sats: list[pd.DataFrame], coll_data: CollocatedDataset=None
+    sntl: SnotelDataset, sats: list[pd.DataFrame], coll_data: CollocatedDataset=None,
+    sat_name: str=None
 ) -> CollocatedDataset:
     """ 
     Collocated multiple swaths overa defined area each sats element is a swath DataFrame
@@ -33,40 +47,208 @@ def collocate_multiple(
         coll_data = CollocatedDataset()
 
     for sat in sats:
-        coll_data = collocate(sntl=sntl, sat=sat, coll_data=coll_data)    
+        coll_data = collocate(sntl=sntl, sat=sat, coll_data=coll_data, sat_name=sat_name)
  
     return coll_data
 
 
 def collocate(
-    sntl: SnotelDataset, sat: pd.DataFrame, coll_data: CollocatedDataset = None
+    sntl: SnotelDataset, sat: pd.DataFrame, coll_data: CollocatedDataset = None,
+    sat_name: str = None, box_len_km: float = None, time_delay: list = None,
+    dedup: PixelDeduplicator = None, mode: str = None
 ) -> CollocatedDataset:
     """
     Performs collocation. If the site is not created create it. Can add new
-    CollocatedSiteData to previous CollocatedDataset or create new one
+    CollocatedSiteData to previous CollocatedDataset or create new one. Every
+    match is tagged with the satellite name and the swath time it was
+    collocated at. Matches point into sat and the site's hourly data
+    (FrameSlice) instead of copying them. box_len_km, time_delay and mode
+    default to BOX_LEN_KM, TIME_DELAY and COLLOCATION_MODE. With dedup the
+    pixels already collocated with a station are dropped from its match
     """
 
     if coll_data is None:
         coll_data = CollocatedDataset()
-
-    for code, site in sntl:
-        coll_sat = spatial_collocation(site.lon, site.lat, sat)
-        coll_sntl = temporal_colloacation(site.hourly, coll_sat["datetime"].max())
-
-        if not coll_sat.empty and not coll_sntl.empty:
+    if box_len_km is None:
+        box_len_km = BOX_LEN_KM
+    if time_delay is None:
+        time_delay = TIME_DELAY
+
+    metrics.count("station_swath_pairs", len(sntl))
+    stations = list(sntl)
+    times = sat["datetime"].to_numpy()
+
+    matched = station_pixels(sat, stations, box_len_km, mode)
+    if dedup is not None:
+        matched = dedup.filter(sat, stations, matched, sat_name)
+
+    for (code, site), pixels in zip(stations, matched):
+        if len(pixels) == 0:
+            continue
+
+        _, t_max = time_range(times[pixels])
+        coll_sat = FrameSlice(sat, pixels)
+        coll_sntl = FrameSlice(site.hourly, hourly_window(site.hourly,
+                                                          t_max + np.timedelta64(time_delay[0], "m"),
+                                                          t_max + np.timedelta64(time_delay[1], "m")))
+
+        if not coll_sntl.empty:
             if not coll_data.has_site(code):
-                coll_data.add_site(CollocatedSiteData(code, site.lon, site.lat))
+                coll_data.add_site(CollocatedSiteData(code, site.lon, site.lat, site.state, site.elev))
 
-            coll_data.add_collocated_data(code, coll_sat, coll_sntl)
+            coll_data.add_collocated_data(code, coll_sat, coll_sntl,
+                                          {"satellite": sat_name, "datetime": t_max})
+            metrics.count("matches")
 
     return coll_data
 
 
+def station_pixels(sat: pd.DataFrame, stations: list, box_len_km: float, mode: str = None) -> list[np.ndarray]:
+    """
+    Positions of the swath pixels collocated with every (code, site) of
+    stations, in swath order. In "box" mode the pixels in the box of side
+    box_len_km, in "radius" mode the pixels within box_len_km / 2 great
+    circle distance. mode defaults to COLLOCATION_MODE
+    """
+    if mode is None:
+        mode = COLLOCATION_MODE
+
+    if mode == "radius":
+        return swath_radius_index(sat)([site.lon for _, site in stations],
+                                       [site.lat for _, site in stations], box_len_km / 2)
+    elif mode == "box":
+        box = swath_box_index(sat)
+        return [box(site.lon, site.lat, box_len_km) for _, site in stations]
+
+    raise ValueError("COLLOCATION-MODE can only be 'box' or 'radius'")
+
+
+def unit_vectors(lon, lat) -> np.ndarray:
+    """
+    (n, 3) cartesian coordinates of lon, lat on the unit sphere
+    """
+    lon = np.radians(np.asarray(lon, dtype=float))
+    lat = np.radians(np.asarray(lat, dtype=float))
+
+    return np.stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=-1).reshape(-1, 3)
+
+
+def chord_length(radius_km: float) -> float:
+    """
+    Straight line distance on the unit sphere of a great circle distance
+    """
+    return 2 * np.sin(radius_km / (2 * EARTH_RADIUS_KM))
+
+
+def swath_radius_index(sat: pd.DataFrame):
+    """
+    Puts the swath pixels on the unit sphere once so that a great circle
+    radius around a station is a ball of chord_length radius, which has no
+    issue at the dateline or with longitudes narrowing near the poles. Uses
+    a KD-tree queried for all stations at once if scipy is installed and
+    compares with every pixel otherwise. Returns a function of (lons, lats,
+    radius_km) giving the positions of the pixels of every station in swath
+    order
+    """
+    xyz = unit_vectors(sat["longitude"].to_numpy(), sat["latitude"].to_numpy())
+
+    # An unbalanced tree builds several times faster and a swath is queried once
+    try:
+        tree = spatial.cKDTree(xyz, balanced_tree=False, compact_nodes=False)
+    except ImportError:     # scipy is optional
+        tree = None
+
+    def radius(site_lons: list, site_lats: list, radius_km: float) -> list[np.ndarray]:
+        stations = unit_vectors(site_lons, site_lats)
+        r = chord_length(radius_km)
+
+        if tree is None:
+            return [np.flatnonzero(((xyz - station)**2).sum(axis=1) <= r * r) for station in stations]
+
+        return [np.asarray(pixels, dtype=np.intp)
+                for pixels in tree.query_ball_point(stations, r, return_sorted=True)]
+
+    return radius
+
+
+def radius_collocation(lon: float, lat: float, sat: pd.DataFrame, radius_km: float) -> pd.DataFrame:
+    """
+    Pixels of sat within radius_km great circle distance of lon, lat
+    """
+    xyz = unit_vectors(sat["longitude"].to_numpy(), sat["latitude"].to_numpy())
+    r = chord_length(radius_km)
+
+    return sat[((xyz - unit_vectors(lon, lat))**2).sum(axis=1) <= r * r]
+
+
+def swath_box_index(sat: pd.DataFrame):
+    """
+    Sorts the swath pixels by latitude once so the pixels of a station's box
+    are narrowed down to a latitude band with a binary search instead of
+    comparing the whole swath for every station. Returns a function of
+    (lon, lat, box_len_km) giving the positions of the pixels that
+    spatial_collocation would select, in swath order
+    """
+    lon = sat["longitude"].to_numpy()
+    lat = sat["latitude"].to_numpy()
+    order = np.argsort(lat, kind="stable")
+    sorted_lat = lat[order].astype(float)
+
+    def box(site_lon: float, site_lat: float, box_len_km: float) -> np.ndarray:
+        lon_bounds = km_to_deg(0, box_len_km / 2)
+        start, stop = np.searchsorted(sorted_lat, [site_lat - lon_bounds - 1e-3, site_lat + lon_bounds + 1e-3])
+        index = np.sort(order[start:stop])
+
+        # ! Same comparisons and dtypes as spatial_collocation
+        lat_bounds = km_to_deg(lat[index], box_len_km / 2)
+        is_in = (
+            (lon[index] < site_lon + lat_bounds)
+            & (lon[index] > site_lon - lat_bounds)
+            & (lat[index] < site_lat + lon_bounds)
+            & (lat[index] > site_lat - lon_bounds)
+        )
+
+        return index[is_in]
+
+    return box
+
+
+def time_range(times: np.ndarray) -> tuple:
+    """
+    Earliest and latest of times skipping NaT, like DataFrame min and max
+    """
+    times = times[~np.isnat(times)]
+
+    if len(times) == 0:
+        return pd.NaT, pd.NaT
+
+    return pd.Timestamp(times.min()), pd.Timestamp(times.max())
+
+
+def hourly_window(hourly: pd.DataFrame, start, stop) -> slice | np.ndarray:
+    """
+    Rows of hourly with start < Date_Time < stop, the same rows as
+    temporal_colloacation. A [start, stop) slice found by binary search
+    when Date_Time is sorted, the row positions otherwise
+    """
+    times = hourly["Date_Time"]
+
+    if pd.isna(start) or pd.isna(stop):
+        return slice(0, 0)
+    elif times.is_monotonic_increasing:
+        return slice(int(times.searchsorted(start, side="right")), int(times.searchsorted(stop, side="left")))
+
+    return np.flatnonzero(((times > start) & (times < stop)).to_numpy())
+
+
 # Find satellite data that is in the site bounds
 # ! Neglects boundary issues ... no snotel stations are near bonudaries
-def spatial_collocation(lon: int, lat: int, sat: pd.DataFrame) -> pd.DataFrame:
-    lat_bounds = km_to_deg(sat["latitude"], BOX_LEN_KM / 2)
-    lon_bounds = km_to_deg(0, BOX_LEN_KM / 2)
+def spatial_collocation(lon: int, lat: int, sat: pd.DataFrame, box_len_km: float=None) -> pd.DataFrame:
+    if box_len_km is None:
+        box_len_km = BOX_LEN_KM
+
+    lat_bounds = km_to_deg(sat["latitude"], box_len_km / 2)
+    lon_bounds = km_to_deg(0, box_len_km / 2)
 
     return sat[
         (sat["longitude"] < lon + lat_bounds)
@@ -78,9 +260,12 @@ def spatial_collocation(lon: int, lat: int, sat: pd.DataFrame) -> pd.DataFrame:
 
 # Find snotel data within satellite time frame
 # ! Collocate with daily data?
-def temporal_colloacation(sntl: pd.DataFrame, t_max: np.datetime64) -> pd.DataFrame:
-    delta_s = np.timedelta64(TIME_DELAY[0], "m")
-    delta_e = np.timedelta64(TIME_DELAY[1], "m")
+def temporal_colloacation(sntl: pd.DataFrame, t_max: np.datetime64, time_delay: list=None) -> pd.DataFrame:
+    if time_delay is None:
+        time_delay = TIME_DELAY
+
+    delta_s = np.timedelta64(time_delay[0], "m")
+    delta_e = np.timedelta64(time_delay[1], "m")
     # metric could be switch to more effective onces
     
     return sntl[
@@ -88,121 +273,267 @@ def temporal_colloacation(sntl: pd.DataFrame, t_max: np.datetime64) -> pd.DataFr
     ]
 
 
-def accumulate_daily(sats: list[pd.DataFrame]) -> pd.DataFrame:
+def pair_collocated(
+    coll: CollocatedDataset, sntl: SnotelDataset, target_data: str, temp_data: str,
+    time_delay: list=None, by: str="pixel"
+) -> pd.DataFrame:
     """
-    Reads a collection of satellite collocated data and returns a list of daily
-    accumulated data. Accumulated daily data is calculated by taking the mean 
-    of non-zero values and multiplying by 24
+    Pairs every collocated pixel (by="pixel") or scanline (by="scanline")
+    with its own snotel window, the hours within time_delay of its scan
+    time, instead of the one window at the swath's max time. The windows of
+    every pixel of a site come from two binary searches into the site's
+    sorted hourly data. Returns one row per pixel or scanline with the
+    columns of Statistics.match_table plus longitude and latitude, so the
+    table can be given to Statistics.stratified, threshold_sweep and
+    bootstrap. Pairs are made before quality control, n is 1 when both sfr
+    and swe are known
     """
-    
-    sats = pd.concat(sats, ignore_index=True, axis=0)
+    if time_delay is None:
+        time_delay = TIME_DELAY
+    if by not in ("pixel", "scanline"):
+        raise ValueError("by can only be 'pixel' or 'scanline'")
+
+    columns = ["site", "state", "elev", "satellite", "datetime", "longitude", "latitude", "temp",
+               "sfr_sum", "sfr_count", "swe_sum", "swe_count", "n", "x", "y", "sfr_max", "swe_max"]
+    tables = []
+
+    for code, site in coll:
+        sats = list(site.sat.iter_frames())
+        if len(sats) == 0:
+            continue
+
+        sat = pd.concat(sats, ignore_index=True)[["datetime", "longitude", "latitude", "sfr"]]
+        sat["match"] = np.repeat(np.arange(len(sats)), [len(frame) for frame in sats])
+        sat = sat[sat["datetime"].notna()]
+
+        if by == "scanline":
+            pairs = sat.groupby(["match", "datetime"], sort=False).agg(
+                longitude=("longitude", "mean"), latitude=("latitude", "mean"),
+                sfr_sum=("sfr", "sum"), sfr_count=("sfr", "size"),
+                sfr_max=("sfr", "max"), x=("sfr", "mean"),
+            ).reset_index()
+        else:
+            pairs = sat.rename(columns={"sfr": "x"})
+            pairs["sfr_sum"] = pairs["x"].fillna(0.0)
+            pairs["sfr_count"] = 1
+            pairs["sfr_max"] = pairs["x"]
 
-    dates = []
-    sf = []
-    t = sats.datetime.min().to_numpy().astype("datetime64[D]")
-    days = (sats.datetime.max() - t).to_numpy().astype("timedelta64[D]").astype(int)+1
+        swe, temp = pair_windows(sntl[code].hourly, pairs["datetime"].to_numpy(), target_data,
+                                 temp_data, time_delay)
 
-    for _ in range(days):
-        dates.append(t)
-        sf.append(sats[(sats.datetime >= t) & 
-                       (sats.datetime <= t + np.timedelta64(1, "D")) & 
-                       (sats.sfr > 0)].sfr.mean() * 24)
-    
-        t += np.timedelta64(1, "D")
-    
-    df = pd.DataFrame({"datetime": dates, "sfr" : sf})
-    df.dropna(inplace=True)
+        pairs["swe_sum"] = swe["sum"]
+        pairs["swe_count"] = swe["count"]
+        pairs["swe_max"] = swe["max"]
+        pairs["temp"] = temp["mean"]
+        pairs["n"] = (swe["valid"] > 0) & pairs["x"].notna().to_numpy()
+        pairs["y"] = np.where(pairs["n"], swe["mean"], 0.0)
+        pairs["x"] = np.where(pairs["n"], pairs["x"], 0.0)
+        pairs["n"] = pairs["n"].astype(int)
 
-    return df
+        pairs["site"] = code
+        pairs["state"] = site.state
+        pairs["elev"] = site.elev
+        pairs["satellite"] = [site.meta[i].get("satellite") for i in pairs["match"]]
+        tables.append(pairs[columns])
 
+    if len(tables) == 0:
+        return pd.DataFrame(columns=columns)
 
-def km_to_deg(lat, km):
-    MEAN_EARTH_RADIUS = 6371
-    r2 = MEAN_EARTH_RADIUS * np.cos(lat * (np.pi / 180))
+    return pd.concat(tables, ignore_index=True)
 
-    return (km / r2) * (180 / np.pi)
 
+def pair_windows(hourly: pd.DataFrame, times: np.ndarray, target_data: str, temp_data: str,
+                 time_delay: list) -> tuple[dict, dict]:
+    """
+    Reduces the hourly rows with time + time_delay[0] < Date_Time < time +
+    time_delay[1] of every time, the same window as temporal_colloacation.
+    Windows are found with searchsorted and reduced one hour offset at a
+    time for all times at once. Returns dicts of sum, count (hours in the
+    window), valid (hours that are not NaN), mean and max arrays for the
+    target and the temperature column
+    """
+    if not hourly["Date_Time"].is_monotonic_increasing:
+        hourly = hourly[hourly["Date_Time"].notna()].sort_values("Date_Time", kind="stable")
+
+    hours = hourly["Date_Time"].to_numpy()
+    times = times.astype(hours.dtype)
+    start = np.searchsorted(hours, times + np.timedelta64(time_delay[0], "m"), side="right")
+    stop = np.searchsorted(hours, times + np.timedelta64(time_delay[1], "m"), side="left")
+    stop = np.maximum(start, stop)
+    width = int((stop - start).max(initial=0))
+
+    reduced = []
+    for column in (target_data, temp_data):
+        values = (hourly[column].to_numpy(dtype=float) if column in hourly.columns
+                  else np.full(len(hourly), np.NaN))
+        window = {"sum": np.zeros(len(times)), "count": stop - start,
+                  "valid": np.zeros(len(times), dtype=int), "max": np.full(len(times), np.NaN)}
+
+        for offset in range(width):
+            row = start + offset
+            value = np.where(row < stop, values[np.minimum(row, len(values) - 1)], np.NaN)
+            window["sum"] += np.nan_to_num(value)
+            window["valid"] += ~np.isnan(value)
+            window["max"] = np.fmax(window["max"], value)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            window["mean"] = np.where(window["valid"] > 0, window["sum"] / window["valid"], np.NaN)
+        reduced.append(window)
+
+    return reduced[0], reduced[1]
+
+
+def collocate_candidates(
+    sntl: SnotelDataset, sat: pd.DataFrame, box_len_km: float, time_delay: list,
+    coll_data: CollocatedDataset = None, sat_name: str = None, dedup: PixelDeduplicator = None,
+    mode: str = None
+) -> CollocatedDataset:
+    """
+    Collocates at the largest box and widest delay range of a sweep. The snotel
+    window spans from the earliest to the latest pixel time of the match so
+    that any smaller box, whose max pixel time falls in between, and any
+    delay range inside time_delay can be filtered out of the candidates.
+    dedup and mode as in collocate
+    """
 
-def main():
-    print("Starting...")
+    if coll_data is None:
+        coll_data = CollocatedDataset()
 
-    with open("config.json") as f:
-        config = json.load(f)
+    metrics.count("station_swath_pairs", len(sntl))
+    stations = list(sntl)
+    times = sat["datetime"].to_numpy()
 
-    print("config file read...")
+    matched = station_pixels(sat, stations, box_len_km, mode)
+    if dedup is not None:
+        matched = dedup.filter(sat, stations, matched, sat_name)
 
-    # =========================================================================
+    for (code, site), pixels in zip(stations, matched):
+        if len(pixels) != 0:
+            t_min, t_max = time_range(times[pixels])
+            coll_sat = FrameSlice(sat, pixels)
+            coll_sntl = FrameSlice(site.hourly, hourly_window(site.hourly,
+                                                              t_min + np.timedelta64(time_delay[0], "m"),
+                                                              t_max + np.timedelta64(time_delay[1], "m")))
 
-    # Set global constants
-    global BOX_LEN_KM
-    BOX_LEN_KM = config["BOX-LEN-KM"]
+            if not coll_sntl.empty:
+                if not coll_data.has_site(code):
+                    coll_data.add_site(CollocatedSiteData(code, site.lon, site.lat, site.state, site.elev))
 
-    global TIME_DELAY
-    TIME_DELAY = config["TIME-DELAY-RANGE"]
+                coll_data.add_collocated_data(code, coll_sat, coll_sntl,
+                                              {"satellite": sat_name, "datetime": t_max})
+                metrics.count("candidate_matches")
 
-    center = config["TARGET-CENTER"]
-    
-    # =========================================================================
+    return coll_data
 
-    # Read data
-    sntl = FileReader.read_sntl_data(config["path-to-sntl-hourly"])
-    hourly_swe_to_rate(sntl, config["sntl-target-data"], "hourly", True)
 
-    print("Snotel data read...")
+def filter_candidates(
+    candidates: CollocatedDataset, box_len_km: float, time_delay: list, mode: str = None
+) -> CollocatedDataset:
+    """
+    Derives the collocation of a smaller box and delay range from the
+    candidates of collocate_candidates. Gives the same matches as collocating
+    with box_len_km and time_delay directly, in "radius" mode the radius is
+    box_len_km / 2. mode defaults to COLLOCATION_MODE
+    """
+    if mode is None:
+        mode = COLLOCATION_MODE
 
-    sat = {}
-    sat_dirs = config["satellite-directories"]
+    coll_data = CollocatedDataset()
 
-    for sat_name in config["sat-to-run"]:
-        print(f"Reading {sat_name}")
-        sat[sat_name] = FileReader.read_all(sat_dirs[sat_name], center, config["date-to-run"])
+    for code, site in candidates:
+        for sat, sntl, meta in zip(site.sat.iter_frames(), site.sntl.iter_frames(), site.meta):
+            if mode == "radius":
+                coll_sat = radius_collocation(site.lon, site.lat, sat, box_len_km / 2)
+            else:
+                coll_sat = spatial_collocation(site.lon, site.lat, sat, box_len_km)
+            t_max = coll_sat["datetime"].max()
+            coll_sntl = temporal_colloacation(sntl, t_max, time_delay)
 
-    print("Satellite data read...")
+            if not coll_sat.empty and not coll_sntl.empty:
+                if not coll_data.has_site(code):
+                    coll_data.add_site(CollocatedSiteData(code, site.lon, site.lat, site.state, site.elev))
 
-    # =========================================================================
+                coll_data.add_collocated_data(code, coll_sat, coll_sntl, dict(meta, datetime=t_max))
 
-    # Collocation
-    collocated_data = CollocatedDataset()
+    return coll_data
 
-    for sat_name, sat_dfs in sat.items():
-        collocated_data = collocate_multiple(sntl=sntl, sats=sat_dfs, coll_data=collocated_data)
 
-    print("Collocation complete...")
+def accumulate_daily(sats: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Reads a collection of satellite collocated data and returns a list of daily
+    accumulated data. Accumulated daily data is calculated by taking the mean 
+    of non-zero values and multiplying by 24
+    """
+    
+    sats = pd.concat(sats, ignore_index=True, axis=0)
 
-    # =========================================================================
+    dates = []
+    sf = []
+    t = sats.datetime.min().to_numpy().astype("datetime64[D]")
+    days = (sats.datetime.max() - t).to_numpy().astype("timedelta64[D]").astype(int)+1
 
-    print("Saving data...")
+    for _ in range(days):
+        dates.append(t)
+        sf.append(sats[(sats.datetime >= t) & 
+                       (sats.datetime <= t + np.timedelta64(1, "D")) & 
+                       (sats.sfr > 0)].sfr.mean() * 24)
+    
+        t += np.timedelta64(1, "D")
+    
+    df = pd.DataFrame({"datetime": dates, "sfr" : sf})
+    df.dropna(inplace=True)
 
-    # Save data
-    folder = config["folder-output-path"]
+    return df
 
-    if folder != "":
-        data_folder = os.path.join(folder, config["folder-output-name"])
-        os.makedirs(data_folder)
-
-        if config["folder-csv-output"]:
-            # Folder output
-            collocated_data.to_csv(folder, config["folder-output-name"])    
-       
-        # config file output
-        with open(os.path.join(data_folder, "config.json"), "w") as f:    
-            json.dump(config, f)
-
-        # pickle output
+
+def save_outputs(collocated_data: CollocatedDataset, config: dict, data_folder: str, overwrite: bool=False,
+                 sntl: SnotelDataset=None):
+    """
+    Writes the collocated data, the qc report and if configured the 
+    statistics of one run configuration into data_folder. overwrite allows
+    replacing the outputs of a previous run (resumed runs). With a "pairing"
+    of pixel or scanline the pair table is written too, it needs sntl
+    """
+    os.makedirs(data_folder, exist_ok=overwrite)
+
+    pairs = None
+    if config.get("pairing", "match") != "match":
+        with metrics.stage("pairing"):
+            pairs = pair_collocated(collocated_data, sntl, "hourly_" + config["sntl-target-data"],
+                                    config["sntl-temp-data"], config["TIME-DELAY-RANGE"], config["pairing"])
+        pairs.to_pickle(os.path.join(data_folder, "pairs.pickle"))
+
+    if config["folder-csv-output"]:
+        # Folder output
+        if overwrite and os.path.exists(os.path.join(data_folder, "csv")):
+            shutil.rmtree(os.path.join(data_folder, "csv"))
+        collocated_data.to_csv(data_folder, "csv")
+
+    # config file output
+    with open(os.path.join(data_folder, "config.json"), "w") as f:    
+        json.dump(config, f)
+
+    # pickle output
+    with metrics.stage("save"):
         with open(os.path.join(data_folder, config["pickle-output-file-name"]), "wb") as f:
             pickle.dump(collocated_data, f)
 
-        # pickle qc output
-        stats = Statistics("hourly_" + config["sntl-target-data"], config["sntl-temp-data"])
-        stats.process_collocated_data(collocated_data)
-            
-        # with open(os.path.join(data_folder, "qc_" + config["pickle-output-file-name"]), "wb") as f:
-        #     pickle.dump(collocated_data, f)
+    # pickle qc output
+    stats = Statistics("hourly_" + config["sntl-target-data"], config["sntl-temp-data"])
+    with metrics.stage("qc"):
+        qc_report = stats.process_collocated_data(collocated_data)
+
+    with open(os.path.join(data_folder, "qc_report.json"), "w") as f:
+        json.dump(qc_report, f)
 
-        if config["calculate_stats"] and len(collocated_data) != 0:
-            # Calculate statistics
+    # with open(os.path.join(data_folder, "qc_" + config["pickle-output-file-name"]), "wb") as f:
+    #     pickle.dump(collocated_data, f)
 
-            print("Calculating and saving statistics...")
+    if config["calculate_stats"] and len(collocated_data) != 0:
+        # Calculate statistics
+
+        print("Calculating and saving statistics...")
+        with metrics.stage("statistics"):
             site_stats = {}
 
             for site_code, site in collocated_data:
@@ -214,12 +545,24 @@ def main():
             bias = stats.bias(collocated_data)
             corr = stats.correlation(collocated_data)
             rmse = stats.rmse(collocated_data)
-            
+        
             cm = stats.confusion_matrix(collocated_data)
             pod = stats.POD(cm)
             far = stats.FAR(cm)
             hss = stats.HSS(cm)
 
+            # mergeable sums so statistics of separate runs can be combined
+            acc = StatisticsAccumulator(stats.swe).update_dataset(collocated_data)
+            acc.to_file(os.path.join(data_folder, "statistics_accumulator.json"))
+
+            if config.get("bootstrap-replicates", 0) > 0:
+                intervals = stats.bootstrap(collocated_data, config["bootstrap-replicates"],
+                                            seed=config.get("bootstrap-seed"),
+                                            processes=config.get("bootstrap-processes", 1))
+
+                with open(os.path.join(data_folder, "bootstrap.json"), "w") as f:
+                    json.dump({str(key): value for key, value in intervals.items()}, f)
+
             # statistics output
             with open(os.path.join(data_folder, "statistics.txt"), "w") as f:
                 f.write("Global Stats:\n")
@@ -235,16 +578,298 @@ def main():
                     f.write(f"Bias: {stat[0]}\n")
                     f.write(f"Corr: {stat[1]}\n")
                     f.write(f"Rmse: {stat[2]}\n")
-                    f.write(f"POD: {stat[3]}\n")
-                    f.write(f"FARate: {stat[4]}\n")
-                    f.write(f"HSS: {stat[5]}\n\n")
+                    f.write(f"POD: {stat[4]}\n")
+                    f.write(f"FARate: {stat[5]}\n")
+                    f.write(f"HSS: {stat[6]}\n\n")
+
+            if pairs is not None:
+                stats.stratified(pairs, by=["satellite"]).to_csv(
+                    os.path.join(data_folder, "pair_statistics.csv"))
+
+    else:
+        print("No collocation, can not calculate statistics")
+
+
+def sweep_configs(config: dict) -> list[dict]:
+    """
+    Expands "SWEEP-BOX-LEN-KM" and "SWEEP-TIME-DELAY-RANGE" into one config
+    per combination, each with its own output folder name
+    """
+    configs = []
+
+    for box_len_km in config.get("SWEEP-BOX-LEN-KM", [config["BOX-LEN-KM"]]):
+        for time_delay in config.get("SWEEP-TIME-DELAY-RANGE", [config["TIME-DELAY-RANGE"]]):
+            configs.append(dict(
+                config, **{
+                    "BOX-LEN-KM": box_len_km,
+                    "TIME-DELAY-RANGE": time_delay,
+                    "folder-output-name": f"{config['folder-output-name']}"
+                                          f"-box{box_len_km}-delay{time_delay[0]}-{time_delay[1]}",
+                }
+            ))
+
+    return configs
+
+
+def sweep_range(config: dict) -> tuple | None:
+    """
+    (box_len_km, time_delay) the candidates of the sweep of config are
+    collocated at, the largest box and widest window, None without a sweep
+    """
+    if "SWEEP-BOX-LEN-KM" not in config and "SWEEP-TIME-DELAY-RANGE" not in config:
+        return None
+
+    configs = sweep_configs(config)
+
+    return (max(c["BOX-LEN-KM"] for c in configs),
+            [min(c["TIME-DELAY-RANGE"][0] for c in configs), max(c["TIME-DELAY-RANGE"][1] for c in configs)])
+
+
+# Config keys a region of "REGIONS" can set, the rest is shared by the run
+REGION_KEYS = ("TARGET-CENTER", "BOX-LEN-KM", "TIME-DELAY-RANGE", "SWEEP-BOX-LEN-KM", "SWEEP-TIME-DELAY-RANGE",
+               "COLLOCATION-MODE", "dedup-pixels", "pairing", "sntl-temp-data", "folder-csv-output",
+               "pickle-output-file-name", "calculate_stats", "bootstrap-replicates", "bootstrap-seed",
+               "bootstrap-processes")
+
+
+def region_configs(config: dict) -> list[dict]:
+    """
+    Expands "REGIONS" (dict of region name:config keys of the region, e.g.
+    TARGET-CENTER, BOX-LEN-KM, TIME-DELAY-RANGE) into one config per region,
+    each with its own output folder name <folder-output-name>-<region name>.
+    A config without regions is its only region. Regions can only set
+    REGION_KEYS
+    """
+    if "REGIONS" not in config:
+        return [config]
+
+    configs = []
+
+    for name, region in config["REGIONS"].items():
+        unsupported = sorted(set(region) - set(REGION_KEYS))
+        if len(unsupported) != 0:
+            raise ValueError(f"Region {name} sets {unsupported}, regions can only set {list(REGION_KEYS)}")
+
+        region_config = {key: value for key, value in config.items() if key != "REGIONS"}
+        region_config.update(region)
+        region_config["folder-output-name"] = f"{config['folder-output-name']}-{name}"
+        configs.append(region_config)
+
+    return configs
+
+
+def collocate_swath(
+    sntl: SnotelDataset, sat_df: pd.DataFrame, sat_name: str, coll_data: CollocatedDataset, sweep: tuple = None,
+    box_len_km: float = None, time_delay: list = None, dedup: PixelDeduplicator = None, mode: str = None
+) -> CollocatedDataset:
+    """
+    Collocates one swath, or its sweep candidates with sweep = (box_len_km,
+    time_delay), as the stage "collocate"
+    """
+    with metrics.stage("collocate", sat_name):
+        if sweep is None:
+            return collocate(sntl, sat_df, coll_data, sat_name, box_len_km, time_delay, dedup, mode)
+
+        return collocate_candidates(sntl, sat_df, sweep[0], sweep[1], coll_data, sat_name, dedup, mode)
+
+
+def collocate_sats(
+    sntl: SnotelDataset, sat: dict, coll_data: CollocatedDataset = None, sweep: tuple = None,
+    dedup: PixelDeduplicator = None
+) -> CollocatedDataset:
+    """
+    Collocates the swaths of every satellite in sat (dict of name:swaths). With
+    sweep = (box_len_km, time_delay) the candidates of a sweep are collocated.
+    The swaths can be a generator (FileReader.iter_all), every swath is then
+    read as the stage "read" just before it is collocated. With dedup the
+    pixels already collocated with a station are dropped from its matches
+    """
+
+    if coll_data is None:
+        coll_data = CollocatedDataset()
+
+    for sat_name, sat_dfs in sat.items():
+        swaths = iter(sat_dfs)
+
+        while True:
+            with metrics.stage("read", sat_name):
+                sat_df = next(swaths, None)
 
+            if sat_df is None:
+                break
+
+            coll_data = collocate_swath(sntl, sat_df, sat_name, coll_data, sweep, dedup=dedup)
+
+    return coll_data
+
+
+def collocate_regions(
+    sntl: SnotelDataset, sat: dict, regions: list[dict], dedups: list[PixelDeduplicator] = None
+) -> list[CollocatedDataset]:
+    """
+    collocate_sats for the configs of several regions (region_configs) read
+    in one scan. sat is a dict of name:(index of the region, swath), as
+    given by FileReader.iter_centers with the centers of the regions. Every
+    swath is collocated with the box, delay range, mode and sweep of its
+    region and deduplicated with the dedup of its region (dedups, None for
+    none)
+    """
+    coll_data = [CollocatedDataset() for _ in regions]
+    sweeps = [sweep_range(region) for region in regions]
+    dedups = dedups if dedups is not None else [None] * len(regions)
+
+    for sat_name, sat_dfs in sat.items():
+        swaths = iter(sat_dfs)
+
+        while True:
+            with metrics.stage("read", sat_name):
+                item = next(swaths, None)
+
+            if item is None:
+                break
+
+            i, sat_df = item
+            coll_data[i] = collocate_swath(sntl, sat_df, sat_name, coll_data[i], sweeps[i],
+                                           regions[i]["BOX-LEN-KM"], regions[i]["TIME-DELAY-RANGE"], dedups[i],
+                                           regions[i].get("COLLOCATION-MODE", "box"))
+
+    return coll_data
+
+
+def output_configs(config: dict) -> list[dict]:
+    """
+    Configs of every output folder a run writes, one per region and sweep
+    combination or the config itself
+    """
+    configs = []
+
+    for region in region_configs(config):
+        if sweep_range(region) is not None:
+            configs.extend(sweep_configs(region))
         else:
-            print("No collocation, can not calculate statistics")
+            configs.append(region)
+
+    return configs
+
+
+def main(config_path: str="config.json"):
+    print("Starting...")
+
+    with open(config_path) as f:
+        config = json.load(f)
+
+    print("config file read...")
+
+    # =========================================================================
+
+    # Set global constants
+    global BOX_LEN_KM
+    BOX_LEN_KM = config["BOX-LEN-KM"]
+
+    global TIME_DELAY
+    TIME_DELAY = config["TIME-DELAY-RANGE"]
+
+    global COLLOCATION_MODE
+    COLLOCATION_MODE = config.get("COLLOCATION-MODE", "box")
+
+    regions = region_configs(config)
+    sweep = sweep_range(config)
+
+    folder = config["folder-output-path"]
+    is_checkpointed = config.get("checkpoint-partitions", False) and folder != ""
+
+    if is_checkpointed and "REGIONS" in config:
+        raise ValueError("REGIONS can not be used with checkpoint-partitions")
+
+    metrics.reset(profile_stage=config.get("profile-stage"))
+    FileReader.pool.reset(config.get("dataset-pool-size", 128))
+    FileReader.prefetch_depth = config.get("prefetch-granules", 0)
+    FileReader.chunk_rows = config.get("chunk-rows")
+
+    for sat_name, options in config.get("satellite-sensors", {}).items():
+        register_sensor(Sensor(sat_name, **options))
+    
+    # =========================================================================
+
+    # Read data
+    with metrics.stage("read_sntl"):
+        sntl = FileReader.read_sntl_data(config["path-to-sntl-hourly"])
+        hourly_swe_to_rate(sntl, config["sntl-target-data"], "hourly", True)
+
+    print("Snotel data read...")
+
+    sat_dirs = config["satellite-directories"]
+    dedups = [PixelDeduplicator() if region.get("dedup-pixels", True) else None for region in regions]
+
+    if is_checkpointed:
+        # Every (satellite, day) is read, collocated and saved on its own, so
+        # pixels are only deduplicated within a partition
+        store = PartitionStore(os.path.join(folder, config["folder-output-name"], "partitions"), config)
+        collocated_data = [CollocatedDataset()]
+
+        for sat_name in config["sat-to-run"]:
+            for day, path in FileReader.list_partitions(sat_dirs[sat_name], config["date-to-run"]):
+                key = f"{sat_name}-{day}"
+                input_hash = PartitionStore.hash_inputs(path)
+                sntl_hash = store.hash_sntl(sntl, day)
+
+                if store.is_complete(key, input_hash, sntl_hash):
+                    print(f"Partition {key} is complete, skipped")
+                else:
+                    print(f"Reading {key}")
+                    sat = {sat_name: FileReader.iter_all(path, config["TARGET-CENTER"], config["date-to-run"],
+                                                         sat_name)}
+                    dedup = PixelDeduplicator() if dedups[0] is not None else None
+                    store.save(key, collocate_sats(sntl, sat, sweep=sweep, dedup=dedup), input_hash, sntl_hash)
+
+                    if dedup is not None:
+                        dedups[0].removed += dedup.removed
+
+                collocated_data[0].merge(store.load(key))
+
+        FileReader.pool.close_all()
+    else:
+        # Every swath is collocated as soon as it is read, granules are read
+        # once for all regions
+        centers = [region["TARGET-CENTER"] for region in regions]
+        sat = {sat_name: FileReader.iter_centers(sat_dirs[sat_name], centers, config["date-to-run"], sat_name)
+               for sat_name in config["sat-to-run"]}
+        collocated_data = collocate_regions(sntl, sat, regions, dedups)
+
+        FileReader.pool.close_all()
+        print("Satellite data read...")
+
+    if any(dedup is not None for dedup in dedups):
+        print(f"Removed {sum(dedup.removed for dedup in dedups if dedup is not None)} duplicate pixels")
+
+    print("Collocation complete...")
+
+    # =========================================================================
+
+    print("Saving data...")
+
+    # Save data
+    if folder != "":
+        for region, region_data in zip(regions, collocated_data):
+            if sweep_range(region) is not None:
+                for sweep_config in sweep_configs(region):
+                    print(f"Saving {sweep_config['folder-output-name']}")
+                    save_outputs(filter_candidates(region_data, sweep_config["BOX-LEN-KM"],
+                                                   sweep_config["TIME-DELAY-RANGE"],
+                                                   sweep_config.get("COLLOCATION-MODE", "box")),
+                                 sweep_config, os.path.join(folder, sweep_config["folder-output-name"]),
+                                 is_checkpointed, sntl)
+            else:
+                save_outputs(region_data, region, os.path.join(folder, region["folder-output-name"]),
+                             is_checkpointed, sntl)
+
+        # run metrics output
+        run_folder = os.path.join(folder, config["folder-output-name"])
+        os.makedirs(run_folder, exist_ok=True)
+        metrics.to_json(run_folder)
 
 
 if __name__ == "__main__":
     start_t = time.time()
-    main()
+    main(sys.argv[1] if len(sys.argv) > 1 else "config.json")
     print(f"Runtime: {time.time() - start_t}")
-
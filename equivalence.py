@@ -0,0 +1,242 @@
+from lib import xr, np, pd, os, json, time, pickle
+from lib.synthetic import write_day, make_sntl_dataset
+from lib.file_reader import FileReader
+from lib.snotel_data import FrameSlice
+from lib.utilities import hourly_swe_to_rate, reduce_sat_df
+from lib.statistics import Statistics, StatisticsAccumulator
+from lib import legacy
+import collocation
+import argparse, copy, tempfile
+
+"""
+Input:
+    Synthetic data (default) or a folder of real granules and the pickled
+    snotel data, optionally sampled down to a number of granules
+    Box length, time delay and tolerances
+
+Output:
+    Pass or fail of every stage with the first differences found and the
+    time of the reference and current implementations as json
+
+Idea:
+    The slow loops that were replaced by vectorized code are kept in
+    lib.legacy. Both are run on the same inputs, stage by stage, and their
+    outputs compared: the decoded granule frames, the matches of every site,
+    the reduced frames, the quality controlled data and the statistics. A
+    stage passes when frames are equal and metrics agree within the relative
+    tolerance. Exits with 1 on any difference so it can gate changes
+
+Usage:
+    python equivalence.py
+    python equivalence.py --granules /data/ATMS/2022 --sntl sntl.pkl --sample 50
+"""
+
+CENTER = (-150, 65)
+TARGET_DATA = "precip_accum_set_1"
+TEMP_DATA = "air_temp_set_1"
+
+
+def synthetic_inputs(folder: str, n_sites: int, layout: str) -> tuple[list[str], object]:
+    """
+    Writes one day of synthetic granules into folder and returns their paths
+    with a snotel dataset around the same center
+    """
+    day = "2022-01-17"
+    files = write_day(folder, layout, day, CENTER, seed=0)
+    sntl = make_sntl_dataset(n_sites, [day, day], CENTER)
+
+    return files, sntl
+
+
+def real_inputs(granules: str, sntl_path: str, sample: int, seed: int) -> tuple[list[str], object]:
+    """
+    Granule files below the granules folder, sampled without replacement when
+    sample is given, and the pickled snotel data
+    """
+    files = sorted(f for f in FileReader.get_all_files(granules) if f.endswith(".nc"))
+
+    if sample is not None and sample < len(files):
+        rng = np.random.default_rng(seed)
+        files = sorted(rng.choice(files, sample, replace=False))
+
+    with open(sntl_path, "rb") as f:
+        sntl = pickle.load(f)
+
+    return files, sntl
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+
+    return result, time.perf_counter() - start
+
+
+def frame_difference(ref: pd.DataFrame, new: pd.DataFrame) -> str | None:
+    """
+    Returns why two frames differ or None if they are equal. Datetime units
+    are not compared since the reference parses strings
+    """
+    try:
+        pd.testing.assert_frame_equal(ref, new, check_dtype=False, check_index_type=False,
+                                      check_datetimelike_compat=True)
+    except AssertionError as e:
+        return str(e).splitlines()[0]
+
+    return None
+
+
+def dataset_difference(ref, new) -> str | None:
+    """
+    Compares two CollocatedDatasets site by site and match by match
+    """
+    ref_codes, new_codes = set(ref.data), set(new.data)
+    if ref_codes != new_codes:
+        return f"sites differ: {sorted(ref_codes ^ new_codes, key=str)[:10]}"
+
+    for code in ref_codes:
+        ref_site, new_site = ref.data[code], new.data[code]
+
+        if len(ref_site) != len(new_site):
+            return f"site {code}: {len(ref_site)} matches != {len(new_site)}"
+
+        for i in range(len(ref_site)):
+            for name, a, b in (("sat", ref_site.sat[i], new_site.sat[i]),
+                               ("sntl", ref_site.sntl[i], new_site.sntl[i])):
+                diff = frame_difference(a, b)
+                if diff is not None:
+                    return f"site {code} match {i} {name}: {diff}"
+
+    return None
+
+
+def metric_difference(ref: dict, new: dict, rtol: float) -> str | None:
+    for key in ref:
+        a, b = np.asarray(ref[key], dtype=float), np.asarray(new[key], dtype=float)
+
+        if not np.allclose(a, b, rtol=rtol, atol=0, equal_nan=True):
+            return f"{key}: {ref[key]} != {new[key]}"
+
+    return None
+
+
+def run(files: list[str], sntl, box_len_km: float, time_delay: list, rtol: float) -> dict:
+    report = {}
+
+    def record(stage, ref, new, diff):
+        report[stage] = {"passed": diff is None, "difference": diff, "reference_s": ref,
+                         "current_s": new, "speedup": ref / new if new > 0 else None}
+        print(f"{stage:<16} {'ok' if diff is None else 'FAIL':<5} {ref:9.4f} s -> {new:9.4f} s"
+              f"  x{report[stage]['speedup'] or 0:.1f}  {diff or ''}")
+
+    hourly_swe_to_rate(sntl, TARGET_DATA, "hourly", True)
+    swe = "hourly_" + TARGET_DATA
+
+    # Decode every granule, held outside the reader's pool so none is evicted
+    datasets = [xr.open_dataset(file) for file in files]
+    ref_sats, ref_t = timed(lambda: [legacy.read_satellite_ncdf(ds) for ds in datasets])
+    new_sats, new_t = timed(lambda: [FileReader.read_satellite_ncdf(ds) for ds in datasets])
+    diff = next((f"{files[i]}: {d}" for i, d in
+                 enumerate(frame_difference(a, b) for a, b in zip(ref_sats, new_sats))
+                 if d is not None), None)
+    record("read", ref_t, new_t, diff)
+
+    for ds in datasets:
+        ds.close()
+
+    # Collocation, both paths are given the same swaths
+    collocation.BOX_LEN_KM = box_len_km
+    collocation.TIME_DELAY = time_delay
+    sats = [sat for sat in new_sats if not sat.empty]
+
+    ref_coll, ref_t = timed(lambda: _legacy_collocate_multiple(sntl, sats, box_len_km, time_delay))
+    new_coll, new_t = timed(lambda: collocation.collocate_multiple(sntl, sats))
+
+    # Pickling, matches have to stay references into the swaths after a dump
+    _, ref_pickle_t = timed(lambda: pickle.dumps(ref_coll))
+    _, new_pickle_t = timed(lambda: pickle.dumps(new_coll))
+    materialized = sum(not isinstance(frame, FrameSlice) for _, site in new_coll
+                       for frames in (site.sat, site.sntl) for frame in frames.frames)
+    pickle_diff = f"{materialized} matches materialized by pickling" if materialized != 0 else None
+
+    record("collocate", ref_t, new_t, dataset_difference(ref_coll, new_coll))
+    record("pickle", ref_pickle_t, new_pickle_t, pickle_diff)
+
+    # Closest pixel per scan time
+    frames = [(site.lon, site.lat, sat) for _, site in new_coll for sat in site.sat]
+    ref_frames = [(lon, lat, sat.copy()) for lon, lat, sat in frames]
+    new_frames = [(lon, lat, sat.copy()) for lon, lat, sat in frames]
+    _, ref_t = timed(lambda: [legacy.reduce_sat_df(sat, lon, lat) for lon, lat, sat in ref_frames])
+    _, new_t = timed(lambda: [reduce_sat_df(sat, lon, lat) for lon, lat, sat in new_frames])
+    diff = next((d for d in (frame_difference(a[2], b[2]) for a, b in zip(ref_frames, new_frames))
+                 if d is not None), None)
+    record("reduce_sat_df", ref_t, new_t, diff)
+
+    # Quality control
+    stats = Statistics(swe, TEMP_DATA)
+    ref_qc, new_qc = copy.deepcopy(new_coll), copy.deepcopy(new_coll)
+    _, ref_t = timed(lambda: legacy.process_collocated_data(ref_qc, swe, TEMP_DATA))
+    _, new_t = timed(lambda: stats.process_collocated_data(new_qc))
+    record("qc", ref_t, new_t, dataset_difference(ref_qc, new_qc))
+
+    # Statistics, the loops of Statistics against one pass of the accumulator
+    def reference_metrics():
+        return {"bias": stats.bias(ref_qc), "corr": stats.correlation(ref_qc),
+                "rmse": stats.rmse(ref_qc), "cm": stats.confusion_matrix(ref_qc)}
+
+    def current_metrics():
+        acc = StatisticsAccumulator(swe).update_dataset(new_qc)
+        return {"bias": acc.bias(), "corr": acc.correlation(), "rmse": acc.rmse(),
+                "cm": acc.confusion_matrix()}
+
+    ref_metrics, ref_t = timed(reference_metrics)
+    new_metrics, new_t = timed(current_metrics)
+    record("statistics", ref_t, new_t, metric_difference(ref_metrics, new_metrics, rtol))
+
+    report["inputs"] = {"granules": len(files), "swaths": len(sats), "sites": len(sntl),
+                        "matches": sum(len(site) for _, site in new_coll),
+                        "box_len_km": box_len_km, "time_delay": time_delay, "rtol": rtol}
+
+    return report
+
+
+def _legacy_collocate_multiple(sntl, sats: list[pd.DataFrame], box_len_km: float, time_delay: list):
+    coll = legacy.CollocatedDataset()
+    for sat in sats:
+        coll = legacy.collocate(sntl, sat, box_len_km, time_delay, coll)
+
+    return coll
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the optimized paths against the reference implementations")
+    parser.add_argument("--granules", default=None, help="folder of real granules, synthetic data if not given")
+    parser.add_argument("--sntl", default=None, help="pickled snotel data for real granules")
+    parser.add_argument("--sample", type=int, default=None, help="number of granules to sample")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sites", type=int, default=50, help="synthetic snotel sites")
+    parser.add_argument("--layout", default="normal", help="synthetic granule layout")
+    parser.add_argument("--box-len-km", type=float, default=50)
+    parser.add_argument("--time-delay", type=int, nargs=2, default=[0, 120])
+    parser.add_argument("--rtol", type=float, default=1e-5, help="relative tolerance of the statistics")
+    parser.add_argument("--output", default="equivalence_report.json")
+    args = parser.parse_args()
+
+    if args.granules is not None:
+        if args.sntl is None:
+            parser.error("--sntl is required with --granules")
+        files, sntl = real_inputs(args.granules, args.sntl, args.sample, args.seed)
+    else:
+        files, sntl = synthetic_inputs(tempfile.mkdtemp(prefix="sfr_equivalence_"), args.sites, args.layout)
+
+    report = run(files, sntl, args.box_len_km, list(args.time_delay), args.rtol)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4, default=str)
+
+    if not all(stage["passed"] for name, stage in report.items() if name != "inputs"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+from lib import np, os, json, pickle, time
+from lib.snotel_data import CollocatedDataset
+from lib.file_reader import FileReader
+from lib.utilities import hourly_swe_to_rate
+from collocation import output_configs, save_outputs
+from concurrent.futures import ThreadPoolExecutor
+import argparse, subprocess, sys, shutil
+
+"""
+Input:
+    config.json of a full run
+    Number of date shards
+
+Output:
+    The same collocated data and statistics as running collocation.py on the
+    whole config, written to the same output folder
+
+Idea:
+    Split the config into (satellite, date range) shards that each run
+    collocation.py as an independent process, either locally or submitted to a
+    batch scheduler through a command template, then merge the pickles that
+    the shards write and calculate the statistics once on the merged data
+
+Usage:
+    python launcher.py config.json --shards 4 --workers 4
+    python launcher.py config.json --shards 8 --command "sbatch --wait --wrap '{python} {script} {config}'"
+    python launcher.py config.json --shards 8 --merge-only
+    python launcher.py config.json --shards 4 --rerun
+"""
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "collocation.py")
+
+
+def split_dates(date_range: list, n: int) -> list[list[str]]:
+    """
+    Splits an inclusive [start, end] date range into at most n contiguous
+    inclusive ranges of whole days
+    """
+    days = np.arange(np.datetime64(date_range[0], "D"), np.datetime64(date_range[1], "D") + 1)
+
+    return [[str(chunk[0]), str(chunk[-1])] for chunk in np.array_split(days, min(n, len(days)))]
+
+
+def split_config(config: dict, n: int) -> list[dict]:
+    """
+    Creates one config per (satellite, date range) shard. Satellites that are
+    not stored in day folders can not be filtered by date and get one shard.
+    Shards are ordered by satellite then date so merging them in order gives
+    the same match order as a single run
+    """
+    if config["folder-output-path"] == "":
+        raise ValueError("Sharded runs need a folder-output-path to write shard outputs")
+
+    shard_folder = os.path.join(config["folder-output-path"], config["folder-output-name"], "shards")
+    shards = []
+
+    for sat_name in config["sat-to-run"]:
+        partitions = FileReader.list_partitions(config["satellite-directories"][sat_name], config["date-to-run"])
+        by_day = len(partitions) != 0 and all(len(name) == 8 and name.isdigit() for name, _ in partitions)
+
+        for date_range in split_dates(config["date-to-run"], n if by_day else 1):
+            shards.append(dict(
+                config, **{
+                    "sat-to-run": [sat_name],
+                    "date-to-run": date_range,
+                    "folder-output-path": shard_folder,
+                    "folder-output-name": f"shard{len(shards):03d}-{sat_name}-{date_range[0]}-{date_range[1]}",
+                    "folder-csv-output": False,
+                    "calculate_stats": False,
+                    "bootstrap-replicates": 0,
+                }
+            ))
+
+    return shards
+
+
+def write_shards(shards: list[dict]) -> list[str]:
+    paths = []
+
+    for shard in shards:
+        os.makedirs(shard["folder-output-path"], exist_ok=True)
+        path = os.path.join(shard["folder-output-path"], shard["folder-output-name"] + ".json")
+
+        with open(path, "w") as f:
+            json.dump(shard, f, indent=4)
+        paths.append(path)
+
+    return paths
+
+
+def is_finished(shard: dict) -> bool:
+    """
+    Whether a shard ran to the end with the same config. collocation.py
+    writes run_metrics.json after all its outputs and the config next to
+    every output
+    """
+    if not os.path.exists(os.path.join(shard["folder-output-path"], shard["folder-output-name"], "run_metrics.json")):
+        return False
+
+    for out_config in output_configs(shard):
+        try:
+            with open(os.path.join(out_config["folder-output-path"], out_config["folder-output-name"],
+                                   "config.json")) as f:
+                if json.load(f) != json.loads(json.dumps(out_config)):
+                    return False
+        except (OSError, ValueError):
+            return False
+
+    return True
+
+
+def clear_shard(shard: dict):
+    """
+    Removes the outputs a shard left behind so it can be run again, the
+    partitions of checkpointed shards are kept and skipped by the rerun
+    """
+    if shard.get("checkpoint-partitions", False):
+        return
+
+    for out_config in output_configs(shard) + [shard]:
+        shutil.rmtree(os.path.join(out_config["folder-output-path"], out_config["folder-output-name"]),
+                      ignore_errors=True)
+
+
+def run_shard(config_path: str, command: str=None) -> int:
+    """
+    Runs collocation.py on one shard config. command is a template for
+    submitting the shard to a batch scheduler, {python}, {script} and {config}
+    are filled in. The command has to block until the shard is finished
+    """
+    log = os.path.splitext(config_path)[0] + ".log"
+
+    with open(log, "w") as f:
+        if command is None:
+            return subprocess.run([sys.executable, SCRIPT, config_path], stdout=f, stderr=subprocess.STDOUT).returncode
+
+        return subprocess.run(command.format(python=sys.executable, script=SCRIPT, config=config_path),
+                              shell=True, stdout=f, stderr=subprocess.STDOUT).returncode
+
+
+def merge_shards(config: dict, shards: list[dict]):
+    """
+    Merges the collocated data that every shard wrote, in shard order, and
+    saves the outputs and statistics of the whole run
+    """
+    sntl = None
+    if config.get("pairing", "match") != "match":
+        sntl = FileReader.read_sntl_data(config["path-to-sntl-hourly"])
+        hourly_swe_to_rate(sntl, config["sntl-target-data"], "hourly", True)
+
+    for i, out_config in enumerate(output_configs(config)):
+        merged = CollocatedDataset()
+
+        for shard in shards:
+            shard_out = output_configs(shard)[i]
+            path = os.path.join(shard_out["folder-output-path"], shard_out["folder-output-name"],
+                                shard_out["pickle-output-file-name"])
+
+            with open(path, "rb") as f:
+                merged.merge(pickle.load(f))
+
+        print(f"Saving merged {out_config['folder-output-name']}")
+        save_outputs(merged, out_config, os.path.join(out_config["folder-output-path"],
+                                                      out_config["folder-output-name"]), overwrite=True,
+                     sntl=sntl)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run collocation.py as date/satellite shards and merge them")
+    parser.add_argument("config", nargs="?", default="config.json")
+    parser.add_argument("--shards", type=int, default=1, help="number of date ranges per satellite")
+    parser.add_argument("--workers", type=int, default=1, help="shards running at the same time")
+    parser.add_argument("--command", default=None, help="batch submission template, "
+                        "e.g. \"sbatch --wait --wrap '{python} {script} {config}'\"")
+    parser.add_argument("--merge-only", action="store_true", help="only merge finished shard outputs")
+    parser.add_argument("--rerun", action="store_true", help="run shards that already finished again")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+
+    shards = split_config(config, args.shards)
+    paths = write_shards(shards)
+    print(f"{len(shards)} shards...")
+
+    if not args.merge_only:
+        # Shards that finished in an earlier launch are not run again
+        todo = [(shard, path) for shard, path in zip(shards, paths) if args.rerun or not is_finished(shard)]
+        if len(todo) != len(shards):
+            print(f"{len(shards) - len(todo)} shards already finished, skipped")
+
+        for shard, _ in todo:
+            clear_shard(shard)
+
+        with ThreadPoolExecutor(args.workers) as pool:
+            codes = list(pool.map(lambda item: run_shard(item[1], args.command), todo))
+
+        failed = [path for (_, path), code in zip(todo, codes) if code != 0]
+        if len(failed) != 0:
+            raise RuntimeError(f"Shards failed, see their .log files: {failed}")
+
+    print("Merging shards...")
+    merge_shards(config, shards)
+
+
+if __name__ == "__main__":
+    start_t = time.time()
+    main()
+    print(f"Runtime: {time.time() - start_t}")
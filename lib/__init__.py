@@ -1,5 +1,5 @@
 # Reading Writing
-import h5py, time, os, pickle, json
+import time, os, pickle, json
 
 # Processing Data
 from io import StringIO
@@ -7,6 +7,30 @@ import re
 
 # Data Handling
 import pandas as pd
-import xarray as xr
 import numpy as np
 
+# Lazy loading
+import importlib, types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module that is only imported on first attribute access.
+    The file formats and plotting stacks take seconds to import and most
+    jobs (statistics, workers) never use them
+    """
+
+    def __init__(self, name: str) -> None:
+        super().__init__(name)
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        # Later lookups are found directly instead of through __getattr__
+        self.__dict__.update(module.__dict__)
+
+        return getattr(module, attr)
+
+
+# Loaded on first use by the reader and grapher
+h5py = LazyModule("h5py")
+xr = LazyModule("xarray")
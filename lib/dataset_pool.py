@@ -0,0 +1,105 @@
+from __future__ import annotations
+from lib import xr
+from lib.instrumentation import metrics
+from collections import OrderedDict
+import threading
+
+
+class DatasetPool:
+    """
+    Bounded pool of open NetCDF dataset handles shared by the reader so a
+    granule that is looked at several times (row count, bounds, decoding) is
+    opened once. The least recently used handle is closed when more than
+    max_open are open. Pinned handles are never evicted, the reader pins the
+    granules it still has to decode so no granule is opened twice in a run.
+    Keeps hit, miss, eviction and reopen counts, reopens should stay 0.
+    max_open should be at least the 16 granules of a tiny swath selection
+    """
+
+    def __init__(self, max_open: int=128) -> None:
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1")
+
+        self.max_open = max_open
+        self.handles = OrderedDict()    # dict of path:xr.Dataset, least recent first
+        self.pinned = set()
+        self.opened = set()     # Every path opened since the last reset
+        self.counts = dict.fromkeys(("hits", "misses", "evictions", "reopens"), 0)
+        self.__lock = threading.RLock()
+
+    def __count(self, name: str):
+        self.counts[name] += 1
+        metrics.count(f"dataset_pool_{name}")
+
+    def get(self, path: str) -> xr.Dataset:
+        """
+        Returns the open handle of path, opening it if it is not in the pool
+        """
+        with self.__lock:
+            if path in self.handles:
+                self.handles.move_to_end(path)
+                self.__count("hits")
+                return self.handles[path]
+
+            self.__count("misses")
+            if path in self.opened:
+                self.__count("reopens")
+
+            metrics.count("files_opened")
+            ds = xr.open_dataset(path)
+            self.handles[path] = ds
+            self.opened.add(path)
+            self.__evict()
+
+            return ds
+
+    def __evict(self):
+        unpinned = [path for path in self.handles if path not in self.pinned]
+
+        for path in unpinned[:max(0, len(unpinned) - self.max_open)]:
+            self.handles.pop(path).close()
+            self.__count("evictions")
+
+    def pin(self, paths):
+        """
+        Keeps the handles of paths open until they are unpinned. Paths that
+        are not open yet are kept once they are opened
+        """
+        with self.__lock:
+            self.pinned.update(paths)
+
+    def unpin(self, paths):
+        with self.__lock:
+            self.pinned.difference_update(paths)
+            self.__evict()
+
+    def close(self, path: str):
+        with self.__lock:
+            self.pinned.discard(path)
+            if path in self.handles:
+                self.handles.pop(path).close()
+
+    def close_all(self):
+        """
+        Closes every handle. The paths stay recorded so opening one again in
+        the same run counts as a reopen
+        """
+        with self.__lock:
+            for ds in self.handles.values():
+                ds.close()
+            self.handles.clear()
+            self.pinned.clear()
+
+    def reset(self, max_open: int=None):
+        """
+        Closes every handle and starts a new run
+        """
+        with self.__lock:
+            self.close_all()
+            self.opened.clear()
+            self.counts = dict.fromkeys(self.counts, 0)
+            if max_open is not None:
+                self.max_open = max_open
+
+    def __len__(self) -> int:
+        return len(self.handles)
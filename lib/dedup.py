@@ -0,0 +1,166 @@
+from lib import np, pd
+from lib.instrumentation import metrics
+import zlib
+
+
+def splitmix64(x: np.ndarray) -> np.ndarray:
+    """
+    Mixes every bit of uint64 x into every bit of the result
+    """
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+
+    return x ^ (x >> np.uint64(31))
+
+
+def pixel_keys(sat: pd.DataFrame, satellite: str=None, rows: np.ndarray=None) -> np.ndarray:
+    """
+    64 bit hash of (satellite, scan time, longitude, latitude) of every pixel
+    of sat, or of the pixels at positions rows. A pixel decoded twice, from
+    overlapping swath parts or windows, has the same key. The satellite only
+    seeds the hash, so any two distinct pixels, of the same or different
+    satellites, collide with a probability of about n^2 / 2^65
+    """
+    rows = slice(None) if rows is None else rows
+    seed = np.uint64(zlib.crc32(str(satellite).encode()))
+    times = sat["datetime"].to_numpy()[rows].astype("datetime64[ns]").view(np.int64).view(np.uint64)
+    lon = sat["longitude"].to_numpy(dtype=np.float32)[rows].view(np.uint32).astype(np.uint64)
+    lat = sat["latitude"].to_numpy(dtype=np.float32)[rows].view(np.uint32).astype(np.uint64)
+
+    return splitmix64(splitmix64(times ^ seed) ^ ((lon << np.uint64(32)) | lat))
+
+
+class PixelSet:
+    """
+    Set of uint64 keys in one open addressing table (linear probing) that
+    inserts a whole array of keys at once. Takes 8 bytes per slot and is
+    kept at most half full, against about 70 bytes per key for a python
+    set. Key 0 marks empty slots and is stored as 1
+    """
+
+    def __init__(self, capacity: int=1 << 16) -> None:
+        self.table = np.zeros(1 << max(4, int(capacity - 1).bit_length()), dtype=np.uint64)
+        self.size = 0
+
+    def add(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Adds keys and returns which of them were not in the set yet. Of a key
+        repeated in keys only the first is new
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        keys = np.where(keys == 0, np.uint64(1), keys)
+        unique, first = np.unique(keys, return_index=True)
+
+        while 2 * (self.size + len(unique)) > len(self.table):
+            self.__grow()
+
+        is_new = np.zeros(len(keys), dtype=bool)
+        is_new[first[self.__insert(unique)]] = True
+
+        return is_new
+
+    def __insert(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Inserts distinct keys, returns which were inserted
+        """
+        mask = np.uint64(len(self.table) - 1)
+        slots = (keys & mask).astype(np.intp)
+        inserted = np.zeros(len(keys), dtype=bool)
+        pending = np.arange(len(keys))
+
+        while len(pending) != 0:
+            current = self.table[slots[pending]]
+            is_found = current == keys[pending]
+            is_empty = current == 0
+
+            # Of the keys writing into the same empty slot one is kept
+            candidates = pending[is_empty]
+            self.table[slots[candidates]] = keys[candidates]
+            claims = candidates[self.table[slots[candidates]] == keys[candidates]]
+            inserted[claims] = True
+            self.size += len(claims)
+
+            # Keys that lost a claim check the same slot again, others probe on
+            is_occupied = ~is_found & ~is_empty
+            slots[pending[is_occupied]] = (slots[pending[is_occupied]] + 1) & int(mask)
+            pending = pending[~is_found & ~inserted[pending]]
+
+        return inserted
+
+    def __grow(self):
+        keys = self.table[self.table != 0]
+        self.table = np.zeros(2 * len(self.table), dtype=np.uint64)
+        self.size = 0
+        self.__insert(keys)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, key: int) -> bool:
+        key = np.uint64(key or 1)
+        slot = int(key & np.uint64(len(self.table) - 1))
+
+        while self.table[slot] != 0:
+            if self.table[slot] == key:
+                return True
+            slot = (slot + 1) % len(self.table)
+
+        return False
+
+
+class PixelDeduplicator:
+    """
+    Drops the matches of a station that share pixels with an earlier match
+    of that station in the run, keyed on (station, satellite, scan time,
+    pixel position). Overlapping swath parts of a granule and repeated
+    granules would otherwise be collocated again, counting the same snotel
+    hours twice against the leftover edge pixels. Pixels repeated within a
+    match are dropped. Only the pixels that station_pixels selects are
+    hashed, so the time and the table grow with the matches, not with the
+    pixels read. Counts the removed pixels as duplicate_pixels and the
+    dropped matches as duplicate_matches
+    """
+
+    def __init__(self) -> None:
+        self.seen = PixelSet()
+        self.removed = 0
+
+    def filter(self, sat: pd.DataFrame, stations: list, pixels: list[np.ndarray], satellite: str=None) -> list:
+        """
+        The positions of pixels (one array per (code, site) of stations, as
+        station_pixels gives), empty for a station whose pixels were already
+        collocated with it
+        """
+        sizes = [len(positions) for positions in pixels]
+        if sum(sizes) == 0:
+            return pixels
+
+        with metrics.stage("dedup"):
+            rows = np.concatenate(pixels)
+            codes = np.array([zlib.crc32(str(code).encode()) for code, _ in stations], dtype=np.uint64)
+            keys = splitmix64(pixel_keys(sat, satellite, rows) ^ np.repeat(codes, sizes))
+            is_first = np.zeros(len(keys), dtype=bool)
+            is_first[np.unique(keys, return_index=True)[1]] = True
+            is_new = self.seen.add(keys)
+
+        if is_new.all():
+            return pixels
+
+        splits = np.cumsum(sizes)[:-1]
+        kept = []
+
+        # Pixels seen before this swath drop the whole match, repeats within it only themselves
+        for positions, new, first in zip(pixels, np.split(is_new, splits), np.split(is_first, splits)):
+            if (first & ~new).any():
+                kept.append(positions[:0])
+                metrics.count("duplicate_matches")
+            else:
+                kept.append(positions[new])
+
+        duplicates = len(rows) - sum(len(positions) for positions in kept)
+        self.removed += duplicates
+        metrics.count("duplicate_pixels", duplicates)
+
+        return kept
@@ -1,45 +1,66 @@
+from __future__ import annotations
 from lib import xr, np, pd, h5py, os, pickle
 from lib.utilities import is_in_bounds
+from lib.instrumentation import metrics
+from lib.dataset_pool import DatasetPool
+from lib.prefetch import Prefetcher
+from lib.sensors import Sensor, get_sensor
 
 
 class FileReader:
+    pool = DatasetPool()    # Open granules shared by every read of a run
+    COLUMNS = ["datetime", "longitude", "latitude", "sfr"]
+    prefetch_depth = 0  # Granules read ahead in background threads by iter_all
+    chunk_rows = None   # Scanlines read at once by localize_sat, the whole granule if None
 
     @classmethod
-    def __parse_time(cls, year, month, day, hour, minute, sec):
-        if year <= 0 or month <= 0 or day <= 0 or hour < 0 or minute < 0 or sec < 0:
-            return np.datetime64('NaT')
+    def __scan_times(cls, year, month, day, hour, minute, sec) -> np.ndarray:
+        """
+        Builds the datetime of every scanline from its time parts with array
+        arithmetic. Scanlines with a negative or zero (fill value) part are NaT
+        """
+        year, month, day, hour, minute, sec = (np.asarray(part, dtype=np.int64)
+                                               for part in (year, month, day, hour, minute, sec))
+        is_valid = (year > 0) & (month > 0) & (day > 0) & (hour >= 0) & (minute >= 0) & (sec >= 0)
 
-        return "{}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(
-            year, month, day, hour, minute, sec,
-        )
+        months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+        times = (months.astype("datetime64[D]") + (day - 1).astype("timedelta64[D]")
+                 + hour.astype("timedelta64[h]") + minute.astype("timedelta64[m]")
+                 + sec.astype("timedelta64[s]"))
+
+        return np.where(is_valid, times, np.datetime64("NaT", "s"))
 
     @classmethod
     def __create_clusters(cls, indices: list[int], centers: bool=False) -> list[int]:
         """
-        Perform clustering on a list of integers (indices) and separate them into k
-        clusters
+        Perform clustering on a sorted list of integers (indices). A new cluster
+        starts wherever the gap to the previous index is more than eps. With
+        centers the index closest to the mean of each cluster is returned
+        instead, the first one on ties
         """
-        clusters = []
-
         eps = 100
-        curr_index = indices[0]
-        curr_cluster = [curr_index]
+        indices = np.asarray(indices)
+        starts = np.flatnonzero(np.r_[True, np.diff(indices) > eps])
 
-        for index in indices[1:]:
-            if index <= curr_index + eps:
-                curr_cluster.append(index)
-            else:
-                clusters.append(curr_cluster)
-                curr_cluster = [index]
-            curr_index = index
+        if not centers:
+            return [cluster.tolist() for cluster in np.split(indices, starts[1:])]
 
-        clusters.append(curr_cluster)
+        sizes = np.diff(np.r_[starts, len(indices)])
+        ids = np.repeat(np.arange(len(starts)), sizes)
+        means = np.add.reduceat(indices, starts) / sizes
 
-        if centers: 
-            clusters = [min(cluster, key=lambda x: abs(x - np.mean(cluster))) for cluster in clusters] 
+        # Sorted by cluster then distance to its mean, first of each cluster is closest
+        order = np.lexsort((np.abs(indices - means[ids]), ids))
 
-        return clusters
+        return indices[order[starts]].tolist()
     
+    @classmethod
+    def open_dataset(cls, file: str) -> xr.Dataset:
+        """
+        Open handle of a granule from the pool, do not close it
+        """
+        return cls.pool.get(file)
+
     @classmethod
     def get_all_files(cls, dir_path: str, extension: str=None):
         """
@@ -53,7 +74,20 @@ class FileReader:
         ])
 
     @classmethod
-    def select_sat(cls, center: tuple[float | int], files: list[str] | tuple[str]) -> list[list[str]]:
+    def __first_scanline_bounds(cls, ds: xr.Dataset) -> tuple:
+        attributes = ds.attrs
+
+        return (  # Last scanline has -999 so use first
+            attributes["geospatial_first_scanline_first_fov_lon"],
+            attributes["geospatial_first_scanline_last_fov_lon"],
+            attributes["geospatial_first_scanline_first_fov_lat"],
+            attributes["geospatial_first_scanline_last_fov_lat"],
+        )
+
+    @classmethod
+    def select_sat(
+        cls, center: tuple[float | int], files: list[str] | tuple[str], sensor: str | Sensor=None
+    ) -> list[list[str]]:
         """
         This function selects satellite swaths from files that contains the center
         point. Then it uses the found swaths to build larger swaths that cover 
@@ -62,20 +96,14 @@ class FileReader:
         center: (lon, lat)
         files: MUST BE SORTED
         """
+        window = get_sensor(sensor).granule_window
         indices = []
         selections = []
 
         for index, f in enumerate(files):
-            ds = xr.open_dataset(f)
-            attributes = ds.attrs
-            bounds = (  # Last scanline has -999 so use first
-                attributes["geospatial_first_scanline_first_fov_lon"],
-                attributes["geospatial_first_scanline_last_fov_lon"],
-                attributes["geospatial_first_scanline_first_fov_lat"],
-                attributes["geospatial_first_scanline_last_fov_lat"],
-            )
+            ds = cls.open_dataset(f)
 
-            if is_in_bounds(bounds, center):
+            if is_in_bounds(cls.__first_scanline_bounds(ds), center):
                 indices.append(index) 
 
         if len(indices) != 0:
@@ -83,122 +111,420 @@ class FileReader:
             
             centers = []
             for i in clusters:
-                selections.append(files[max(0, i - 8) : min(i + 8, len(files) - 1)])
+                selections.append(files[max(0, i - window) : min(i + window, len(files) - 1)])
 
         return selections
 
     @classmethod
-    def localize_sat(cls, center: tuple[float | int], file: str | xr.Dataset) -> list: 
+    def __granule_runs(cls, indices: list[int], n_files: int, window: int) -> list[tuple[int, int]]:
+        """
+        The windows of select_sat (window granules on each side) around every
+        cluster of indices as (start, stop) file ranges, windows that overlap
+        are merged into one run
+        """
+        runs = []
+
+        if len(indices) != 0:
+            for i in cls.__create_clusters(indices, centers=True):
+                start, stop = max(0, i - window), min(i + window, n_files - 1)
+
+                if start >= stop:
+                    continue
+                elif len(runs) != 0 and start < runs[-1][1]:
+                    runs[-1] = (runs[-1][0], max(stop, runs[-1][1]))
+                else:
+                    runs.append((start, stop))
+
+        return runs
+
+    @classmethod
+    def assemble_orbits(
+        cls, center: tuple[float | int], files: list[str] | tuple[str], sensor: str | Sensor=None
+    ) -> list[pd.DataFrame]:
+        """
+        Builds the swaths of tiny granule satellites (n20, npp) covering the
+        center. One pass over the granule headers finds the granules whose
+        first scanline contains the center, the granules around them are
+        selected like select_sat but overlapping selections are merged so no
+        granule is in two swaths. Each granule is opened and decoded once
+        into arrays preallocated for the whole run
+
+        center: (lon, lat)
+        files: MUST BE SORTED
+        Returns one time sorted DataFrame per run of granules
+        """
+        return cls.assemble_orbits_centers([center], files, sensor)[0]
+
+    @classmethod
+    def assemble_orbits_centers(
+        cls, centers: list[tuple[float | int]], files: list[str] | tuple[str], sensor: str | Sensor=None
+    ) -> list[list[pd.DataFrame]]:
+        """
+        assemble_orbits for many centers with one pass over the granule
+        headers. A run of granules selected by several centers is decoded
+        once and the same DataFrame is given to each of them
+
+        centers: list of (lon, lat)
+        Returns the list of swaths of every center
+        """
+        window = get_sensor(sensor).granule_window
+        indices = [[] for _ in centers]
+        shapes = []
+        pinned = set()
+
+        try:
+            with metrics.stage("select"):
+                for index, f in enumerate(files):
+                    ds = cls.open_dataset(f)
+                    shapes.append(ds.SFR.shape)
+                    bounds = cls.__first_scanline_bounds(ds)
+
+                    for center, center_indices in zip(centers, indices):
+                        if is_in_bounds(bounds, center):
+                            center_indices.append(index)
+                            # Any run is around an index in bounds, keep them open
+                            selection = files[max(0, index - window) : min(index + window, len(files) - 1)]
+                            pinned.update(selection)
+                            cls.pool.pin(selection)
+
+                runs = [cls.__granule_runs(center_indices, len(files), window) for center_indices in indices]
+                cls.pool.unpin(pinned.difference(f for center_runs in runs
+                                                 for start, stop in center_runs for f in files[start:stop]))
+
+            decoded = {}    # dict of (start, stop):DataFrame
+            for center_runs in runs:
+                for start, stop in center_runs:
+                    if (start, stop) not in decoded:
+                        decoded[(start, stop)] = cls.__read_granule_run(files[start:stop], shapes[start:stop])
+
+            return [[decoded[run] for run in center_runs] for center_runs in runs]
+        finally:
+            cls.pool.unpin(pinned)
+
+    @classmethod
+    def __read_granule_run(cls, files: list[str], shapes: list[tuple[int, int]]) -> pd.DataFrame:
+        with metrics.stage("decode"):
+            size = sum(rows * cols for rows, cols in shapes)
+            pixels = None
+            offset = 0
+
+            for f in files:
+                columns = cls.__pixel_columns(cls.open_dataset(f))
+                n = len(columns["sfr"])
+
+                if pixels is None:
+                    pixels = {key: np.empty(size, dtype=column.dtype) for key, column in columns.items()}
+                for key, column in columns.items():
+                    pixels[key][offset : offset + n] = column
+                offset += n
+
+            df = cls.__valid_pixels(pd.DataFrame(pixels, columns=cls.COLUMNS))
+            df = df.sort_values(by=["datetime"], kind="stable")
+
+        metrics.count("pixels_after_qc", len(df))
+
+        return df
+
+    @classmethod
+    def localize_sat(cls, center: tuple[float | int], file: str | xr.Dataset, sensor: str | Sensor=None) -> list: 
         """
         This function filters large swaths of satellite data to find parts
         of the swaths that cover locations around the center. For n19, moc, mob
         
         center: (lon, lat)
         """
-        ROW_PER_SWATH = 192
-        
-        # Filter lon 
-        closest_indices = [] 
-        dfs = []
-    
+        return cls.localize_sat_centers([center], file, sensor)[0]
+
+    @classmethod
+    def localize_sat_centers(
+        cls, centers: list[tuple[float | int]], file: str | xr.Dataset, sensor: str | Sensor=None
+    ) -> list[list]:
+        """
+        localize_sat for many centers with one scan of the granule. The row
+        means are computed once for all centers and the granule is only
+        decoded if a center is found in it. With chunk_rows the granule is
+        read chunk_rows scanlines at a time and only the scanlines of the
+        swath parts are decoded, so memory does not grow with the granule
+
+        centers: list of (lon, lat)
+        Returns the list of swath parts of every center
+        """
+        ROW_PER_SWATH = get_sensor(sensor).row_per_swath
+
         if type(file) == str:
-            ds = xr.open_dataset(file)
+            ds = cls.open_dataset(file)
         elif type(file) == xr.Dataset:
             ds = file
         else:
             raise ValueError("Invalid parameter values")
 
-        shape = ds.Longitude.data.shape    
-     
-        # Find all row indices that has mean approx equal to the center lon 
-        for i, row in enumerate(ds.Latitude.data):
-            if round(np.mean(row)) == round(center[1]):
-                closest_indices.append(i)
-        
-        if len(closest_indices) != 0: 
-            centers = cls.__create_clusters(closest_indices, centers=True)
-            
-            if len(centers) != 0:
-                # Filter lat
-                df = cls.read_satellite_ncdf(file) 
-                
-                for index in centers:
-                    lon_row = ds.Longitude.data[index]
-                    
+        shape = ds["Longitude"].shape
+        df = None
+        valid_rows = None
+
+        # Rows whose mean lat is approx equal to the center lat
+        row_lat = np.round(cls.__row_means(ds["Latitude"]))
+        localized = []
+
+        for center in centers:
+            dfs = []
+            closest_indices = np.flatnonzero(row_lat == round(center[1]))
+
+            if len(closest_indices) != 0:
+                for index in cls.__create_clusters(closest_indices, centers=True):
+                    lon_row = ds["Longitude"][index].values
+
+                    # Filter lon
                     if is_in_bounds([lon_row[0], lon_row[-1], center[1] + 10, center[1] - 10], center):
-                        dfs.append(df.iloc[max(0, index-int(ROW_PER_SWATH/2)) * shape[1]
-                        : min(index+int(ROW_PER_SWATH/2), len(ds.Latitude.data)) * shape[1]].copy(deep=True))
+                        start = max(0, index-int(ROW_PER_SWATH/2)) * shape[1]
+                        stop = min(index+int(ROW_PER_SWATH/2), shape[0]) * shape[1]
+
+                        if cls.chunk_rows is None:
+                            if df is None:
+                                df = cls.read_satellite_ncdf(ds)
+
+                            dfs.append(df.iloc[start:stop].copy(deep=True))
+                        else:
+                            if valid_rows is None:
+                                valid_rows = cls.__valid_row_counts(ds)
 
-        return dfs
+                            dfs.append(cls.__read_valid_pixels(ds, valid_rows, start, stop))
+
+            localized.append(dfs)
+
+        return localized
 
 
     @classmethod
-    def read_all(cls, folder: str, center: list | tuple, date_range: tuple=None): 
+    def read_all(cls, folder: str, center: list | tuple, date_range: tuple=None, sensor: str | Sensor=None): 
         """
         Can have single swaths or big swaths in one folder but small swaths
         that required to be built up needs to be in its own separate folder
-        Each folder can only contain either folder or files of same type
+        Each folder can only contain either folder or files of same type.
+        sensor is the satellite name (or Sensor) whose reader plugin decides
+        the format and layout of the granules, see lib.sensors
         """
 
-        dfs = []
+        return list(cls.iter_all(folder, center, date_range, sensor))
+
+    @classmethod
+    def iter_all(cls, folder: str, center: list | tuple, date_range: tuple=None, sensor: str | Sensor=None):
+        """
+        Generator of the swaths of read_all, in the same order, so they can
+        be collocated while the next granules are read. With prefetch_depth
+        granules the upcoming granules of a folder are opened and loaded in
+        background threads, each granule is closed once its swaths are
+        yielded so at most prefetch_depth + 1 are held in memory
+        """
+        return (swath for _, swath in cls.iter_centers(folder, [center], date_range, sensor))
+
+    @classmethod
+    def iter_centers(cls, folder: str, centers: list, date_range: tuple=None, sensor: str | Sensor=None):
+        """
+        iter_all for many centers with a single scan of the granules, every
+        granule is opened and decoded once for all centers. Yields (index of
+        the center, swath), the swaths of each center come in the order of
+        iter_all for that center. A swath covering several centers is the
+        same DataFrame for each of them
+        """
+        sensor = get_sensor(sensor)
 
         if os.path.exists(folder):
             files = cls.get_all_files(folder)   # ! Hinges on sorted file date
 
-            if len(files) != 0:
-                for file in files:
-                    if os.path.isfile(file):
-                        try:
-                            ds = xr.open_dataset(file)
-                            rows = ds.SFR.data.shape[0]
-                        except Exception as ex:
-                            # This could still let some error by incase this folder contains rows>700
-                            print(f"Error '{ex}' occured reading file: '{file}' This file is skipped")
-                            continue
-                        
-                        try:
-                            if rows >= 20 and rows < 700: # Swaths that cover the region
-                                if is_in_bounds((ds.attrs["geospatial_first_scanline_first_fov_lon"], 
-                                                 ds.attrs["geospatial_first_scanline_last_fov_lon"],
-                                                 ds.attrs["geospatial_first_scanline_first_fov_lat"],
-                                                 ds.attrs["geospatial_first_scanline_last_fov_lat"]), center):
-                                    dfs.append(cls.read_satellite_ncdf(ds))
-                            elif rows > 700:     # Big swaths need to be filtered
-                                dfs.extend(cls.localize_sat(center, ds)) 
-                            elif rows < 21:   # Tiny swaths need to be built up
-                                selected_files = cls.select_sat(center, files)
-
-                                for swath in selected_files:
-                                    dfs.append(cls.read_multiple_ncdf(swath))
-                                break
-                        except Exception as ex:
-                            print(f"Error '{ex}' occured processing file data of '{file}' This file is skipped")
-                    elif os.path.isdir(file):
-                        if date_range != None:
-                            file_t = file.split("/")[-1] 
-                            start = np.datetime64(date_range[0])
-                            end = np.datetime64(date_range[1])
-
-                            if len(file_t) == 4:    # Convert to year so comparison works
-                                file_date = np.datetime64(file_t)
-
-                                start = start.astype("datetime64[Y]")
-                                end = end.astype("datetime64[Y]")
-                            elif len(file_t) == 8:
-                                file_date = np.datetime64(f"{file_t[:4]}-{file_t[4:6]}-{file_t[6:8]}")
+            if sensor.format == "hdf5" and any(os.path.isfile(file) for file in files):
+                yield from cls.__iter_h5(centers, cls.get_all_files(folder, sensor.extension), sensor)
+            elif len(files) != 0:
+                granules = cls.__prefetch([file for file in files if os.path.isfile(file)])
+
+                try:
+                    for file in files:
+                        if os.path.isfile(file):
+                            try:
+                                with metrics.stage("header_scan"):
+                                    ds = next(granules) if granules is not None else cls.open_dataset(file)
+                                    layout = sensor.layout_of(ds.SFR.shape[0])
+                            except Exception as ex:
+                                # This could still let some error by incase this folder contains rows>700
+                                print(f"Error '{ex}' occured reading file: '{file}' This file is skipped")
+                                metrics.count("files_skipped")
+                                continue
+                            
+                            try:
+                                if layout == "swath": # Swaths that cover the region
+                                    bounds = cls.__first_scanline_bounds(ds)
+                                    covered = [i for i, center in enumerate(centers) if is_in_bounds(bounds, center)]
+
+                                    if len(covered) != 0:
+                                        df = cls.read_satellite_ncdf(ds)
+                                        yield from ((i, df) for i in covered)
+                                    else:
+                                        metrics.count("files_out_of_bounds")
+                                elif layout == "orbit":     # Big swaths need to be filtered
+                                    with metrics.stage("localize"):
+                                        localized = cls.localize_sat_centers(centers, ds, sensor)
+                                    yield from ((i, swath) for i, swaths in enumerate(localized) for swath in swaths)
+                                elif layout == "tiny":   # Tiny swaths need to be built up
+                                    if granules is not None:
+                                        granules.close()
+                                        granules = None
+                                    assembled = cls.assemble_orbits_centers(centers, files, sensor)
+                                    yield from ((i, swath) for i, swaths in enumerate(assembled) for swath in swaths)
+                                    break
+                            except Exception as ex:
+                                print(f"Error '{ex}' occured processing file data of '{file}' This file is skipped")
+                                metrics.count("files_skipped")
+
+                            if granules is not None:
+                                cls.pool.close(file)    # Frees the loaded granule
+                        elif os.path.isdir(file):
+                            if date_range != None:
+                                file_t = file.split("/")[-1] 
+                                file_date, start, end = cls.__folder_date(file_t, date_range)
+
+                                if file_date >= start and file_date <= end:
+                                    yield from cls.iter_centers(file, centers, date_range, sensor)
+                                elif file_date > end:  # ! WORKS ONLY BECAUSE OF 8 char date format for sorting
+                                    break   # Past date range we don't need to continue
                             else:
-                                raise ValueError(f"'{file_t}' Does not recognize folder name time format") 
-
-                            if file_date >= start and file_date <= end:
-                                dfs.extend(cls.read_all(file, center, date_range))
-                            elif file_date > end:  # ! WORKS ONLY BECAUSE OF 8 char date format for sorting
-                                break   # Past date range we don't need to continue
-                        else:
-                            dfs.extend(cls.read_all(file, center, date_range))
+                                yield from cls.iter_centers(file, centers, date_range, sensor)
+                finally:
+                    if granules is not None:
+                        granules.close()
         else:    
             raise ValueError("Invalid folder path")
-        
-        return dfs
+
+    @classmethod
+    def __iter_h5(cls, centers: list, files: list[str], sensor: Sensor):
+        """
+        (index of the center, swath) of a folder of HDF5 granules (ATMS).
+        Swath granules are read whole when their first scanline contains a
+        center, tiny granules are selected like select_sat and every selection
+        is read as one time sorted swath. Orbit granules are only read from
+        netcdf
+        """
+        indices = [[] for _ in centers]
+
+        for index, file in enumerate(files):
+            try:
+                with h5py.File(file, "r") as f:
+                    metrics.count("files_opened")
+
+                    with metrics.stage("header_scan"):
+                        geo = f["ATMS_Swath"]["Geolocation Fields"]
+                        layout = sensor.layout_of(geo["Longitude"].shape[0])
+                        bounds = (geo["Longitude"][0, 0], geo["Longitude"][0, -1],
+                                  geo["Latitude"][0, 0], geo["Latitude"][0, -1])
+
+                    covered = [i for i, center in enumerate(centers) if is_in_bounds(bounds, center)]
+
+                    if layout == "orbit":
+                        raise ValueError("orbit granules can not be read from HDF5")
+                    elif len(covered) == 0:
+                        metrics.count("files_out_of_bounds")
+                        continue
+                    elif layout == "tiny":
+                        for i in covered:
+                            indices[i].append(index)
+                        continue
+
+                    with metrics.stage("decode"):
+                        df = cls.read_satellite_h5(f)
+            except Exception as ex:
+                print(f"Error '{ex}' occured reading file: '{file}' This file is skipped")
+                metrics.count("files_skipped")
+                continue
+
+            yield from ((i, df) for i in covered)
+
+        decoded = {}    # dict of (start, stop):DataFrame
+        for i, center_indices in enumerate(indices):
+            for start, stop in cls.__granule_runs(center_indices, len(files), sensor.granule_window):
+                if (start, stop) not in decoded:
+                    with metrics.stage("decode"):
+                        dfs = []
+                        for file in files[start:stop]:
+                            with h5py.File(file, "r") as f:
+                                dfs.append(cls.read_satellite_h5(f))
+
+                        decoded[(start, stop)] = pd.concat(dfs).sort_values(by=["datetime"], kind="stable")
+
+                yield i, decoded[(start, stop)]
+
+    @classmethod
+    def __prefetch(cls, files: list[str]) -> Prefetcher | None:
+        """
+        Prefetcher of the opened and loaded granules of files, None when
+        prefetching is off or there is nothing to read
+        """
+        if cls.prefetch_depth < 1 or len(files) == 0:
+            return None
+
+        def load(file: str) -> xr.Dataset:
+            ds = cls.open_dataset(file)
+
+            # Granules read in chunks are not loaded whole
+            if cls.chunk_rows is None or ds["SFR"].shape[0] <= cls.chunk_rows:
+                ds.load()
+
+            return ds
+
+        return Prefetcher(load, files, cls.prefetch_depth)
+
+    @classmethod
+    def __folder_date(cls, file_t: str, date_range: tuple) -> tuple:
+        """
+        Parses a 4 (year) or 8 (day) character folder name. Returns the folder
+        date and the date range at the same resolution
+        """
+        start = np.datetime64(date_range[0])
+        end = np.datetime64(date_range[1])
+
+        if len(file_t) == 4:    # Convert to year so comparison works
+            file_date = np.datetime64(file_t)
+
+            start = start.astype("datetime64[Y]")
+            end = end.astype("datetime64[Y]")
+        elif len(file_t) == 8:
+            file_date = np.datetime64(f"{file_t[:4]}-{file_t[4:6]}-{file_t[6:8]}")
+        else:
+            raise ValueError(f"'{file_t}' Does not recognize folder name time format") 
+
+        return file_date, start, end
+
+    @classmethod
+    def list_partitions(cls, folder: str, date_range: tuple=None) -> list[tuple[str, str]]:
+        """
+        Splits a satellite folder into the units read_all can read on their
+        own. Every day folder (8 char date) in the date range is one partition
+        and a folder of files is one partition. Follows the same folder rules
+        as read_all
+
+        Returns sorted list of (name, path)
+        """
+        if not os.path.exists(folder):
+            raise ValueError("Invalid folder path")
+
+        partitions = []
+        files = cls.get_all_files(folder)
+
+        if any(os.path.isfile(file) for file in files):
+            return [(os.path.basename(os.path.normpath(folder)), folder)]
+
+        for file in files:
+            file_t = file.split("/")[-1]
+
+            if date_range is not None:
+                file_date, start, end = cls.__folder_date(file_t, date_range)
+
+                if file_date > end:
+                    break
+                elif file_date < start:
+                    continue
+
+            partitions.extend(cls.list_partitions(file, date_range))
+
+        return partitions
 
     @classmethod
     def read_sntl_data(cls, file: str):
@@ -261,54 +587,111 @@ class FileReader:
         NOT for reading multiple swaths.
         """
 
-        df = cls.read_satellite_ncdf(files[0])
+        df = pd.concat([cls.read_satellite_ncdf(f) for f in files])
 
-        for f in files[1:]:
-            df_copy_df = cls.read_satellite_ncdf(f)
-            df = pd.concat([df, df_copy_df])
+        return df.sort_values(by=["datetime"], kind="stable")
 
-        df.sort_values(by=["datetime"])
+    @classmethod
+    def read_satellite_ncdf(cls, file: str | xr.Dataset):
+        with metrics.stage("decode"):
+            df = cls.__read_satellite_ncdf(file)
+
+        metrics.count("pixels_after_qc", len(df))
 
         return df
 
     @classmethod
-    def read_satellite_ncdf(cls, file: str | xr.Dataset):
+    def __row_chunks(cls, rows: int):
+        """
+        (start, stop) of the scanline chunks of a granule of rows scanlines
+        """
+        step = rows if cls.chunk_rows is None else cls.chunk_rows
+
+        return ((start, min(start + step, rows)) for start in range(0, rows, step))
+
+    @classmethod
+    def __row_means(cls, var: xr.DataArray) -> np.ndarray:
+        """
+        Mean of every scanline of a (scanline, fov) variable, read a chunk of
+        scanlines at a time
+        """
+        return np.concatenate([var[start:stop].values.mean(axis=1)
+                               for start, stop in cls.__row_chunks(var.shape[0])])
+
+    @classmethod
+    def __valid_row_counts(cls, ds: xr.Dataset) -> np.ndarray:
+        """
+        Number of pixels of every scanline that pass __valid_pixels, read a
+        chunk of scanlines at a time
+        """
+        counts = []
+
+        for start, stop in cls.__row_chunks(ds["SFR"].shape[0]):
+            is_valid = ((ds["Longitude"][start:stop].values > -180) & (ds["Latitude"][start:stop].values > -90)
+                        & (ds["SFR"][start:stop].values >= 0.0))
+            counts.append(is_valid.sum(axis=1))
+
+        return np.concatenate(counts)
+
+    @classmethod
+    def __read_valid_pixels(cls, ds: xr.Dataset, valid_rows: np.ndarray, start: int, stop: int) -> pd.DataFrame:
+        """
+        read_satellite_ncdf(ds).iloc[start:stop] that only decodes the
+        scanlines holding those valid pixels. valid_rows is the count of
+        valid pixels of every scanline (__valid_row_counts)
+        """
+        # Valid pixels before every scanline
+        offsets = np.concatenate(([0], np.cumsum(valid_rows)))
+        first = min(np.searchsorted(offsets, start, side="right") - 1, len(valid_rows))
+        last = max(first, np.searchsorted(offsets, stop, side="left"))
+
+        with metrics.stage("decode"):
+            rows = ds.isel({ds["SFR"].dims[0]: slice(first, last)})
+            df = pd.DataFrame(cls.__pixel_columns(rows), columns=cls.COLUMNS)
+            df.index += first * ds["SFR"].shape[1]     # Positions in the whole granule
+            df = cls.__valid_pixels(df).iloc[start - offsets[first]:stop - offsets[first]].copy(deep=True)
+
+        metrics.count("pixels_after_qc", len(df))
+
+        return df
+
+    @classmethod
+    def __read_satellite_ncdf(cls, file: str | xr.Dataset):
         if type(file) == str:
-            ds = xr.open_dataset(file)
+            ds = cls.open_dataset(file)
         elif type(file) == xr.Dataset:
             ds = file
         else:
             raise ValueError("Incorrect file parameters")
 
+        return cls.__valid_pixels(pd.DataFrame(cls.__pixel_columns(ds), columns=cls.COLUMNS))
+
+    @classmethod
+    def __pixel_columns(cls, ds: xr.Dataset) -> dict:
+        """
+        Flattened datetime, longitude, latitude and sfr of every pixel
+        """
         sfr = ds["SFR"].data
         lon = ds["Longitude"].data
         lat = ds["Latitude"].data
         dim = sfr.shape
+        metrics.count("pixels_decoded", sfr.size)
 
         dom = ds["ScanTime_dom"].data.astype("timedelta64[D]").astype(int)
         hour = ds["ScanTime_hour"].data.astype("timedelta64[h]").astype(int)
         minute = ds["ScanTime_minute"].data.astype("timedelta64[m]").astype(int)
         sec = ds["ScanTime_second"].data.astype("timedelta64[s]").astype(int)
 
-        datetime = []
+        datetime = np.repeat(cls.__scan_times(ds["ScanTime_year"].data, ds["ScanTime_month"].data,
+                                              dom, hour, minute, sec), dim[1])
 
-        for i in range(dim[0]):
-            # ! Will give error when parsing -999 current fix sucks
-            datetime.append([cls.__parse_time(ds["ScanTime_year"].data[i],
-                                      ds["ScanTime_month"].data[i],
-                                      dom[i], hour[i], minute[i], sec[i])] * dim[1])
-
-        datetime = np.array(datetime, dtype=np.datetime64)
-
-        df = pd.DataFrame(  # Flatten all
-            {
-                "datetime": datetime.reshape((dim[0] * dim[1],)),
-                "longitude": lon.reshape((dim[0] * dim[1],)),
-                "latitude": lat.reshape((dim[0] * dim[1],)),
-                "sfr": sfr.reshape((dim[0] * dim[1],)),
-            },
-            columns=["datetime", "longitude", "latitude", "sfr"],
-        )
+        return {  # Flatten all
+            "datetime": datetime,
+            "longitude": lon.reshape((dim[0] * dim[1],)),
+            "latitude": lat.reshape((dim[0] * dim[1],)),
+            "sfr": sfr.reshape((dim[0] * dim[1],)),
+        }
 
+    @classmethod
+    def __valid_pixels(cls, df: pd.DataFrame) -> pd.DataFrame:
         return df[(df["longitude"] > -180) & (df["latitude"] > -90) & (df["sfr"] >= 0.0)]
-
@@ -1,11 +1,25 @@
-from matplotlib.colors import LinearSegmentedColormap
-import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 from lib.utilities import reformat_long
-from lib import xr, np, pd
+from lib import xr, np, pd, os, LazyModule
+from lib.sensors import get_sensor
+from lib.snotel_data import CollocatedSiteData
+from concurrent.futures import ProcessPoolExecutor
+
+# ! Plotting stack is only imported when a graph is made
+mcolors = LazyModule("matplotlib.colors")
+mcm = LazyModule("matplotlib.cm")
+mimage = LazyModule("matplotlib.image")
+mfigure = LazyModule("matplotlib.figure")
+magg = LazyModule("matplotlib.backends.backend_agg")
+plt = LazyModule("matplotlib.pyplot")
+netCDF4 = LazyModule("netCDF4")
+ccrs = LazyModule("cartopy.crs")
+cfeature = LazyModule("cartopy.feature")
 
 class Grapher:
+    # Map templates of render_png, built once per process for every
+    # (projection, extent, vmin, vmax, dpi)
+    templates = {}
+    __cmap = None
 
     @classmethod
     def __proper_bounds(cls, left_long, right_long, down_lat, top_lat, margin=10) -> list:
@@ -34,29 +48,55 @@ class Grapher:
         return [reformat_long(left_long), reformat_long(right_long), down_lat, top_lat]
 
     @classmethod
-    def graph_sfr(cls, long, lat, sfr, projection, extent=None, title="SFR"):
+    def colormap(cls):
         """
-        Takes in 2d array long, lat, sfr and graphs the satellite data on a world map
+        The SFR colormap, built once
+        """
+        if cls.__cmap is None:
+            alpha = 0.7
+            color_scl = (
+                [0, (255 / 256, 255 / 256, 255 / 256, alpha)],
+                [0.1, (50 / 256, 95 / 256, 153 / 256, alpha)],
+                [0.2, (99 / 256, 215 / 256, 90 / 256, alpha)],
+                [0.4, (255 / 256, 255 / 256, 84 / 256, alpha)],
+                [0.6, (234 / 256, 51 / 256, 35 / 256, alpha)],
+                [0.8, (159 / 256, 32 / 256, 21 / 256, alpha)],
+                [1.0, (82 / 256, 12 / 256, 6 / 256, alpha)],
+            )
+            cls.__cmap = mcolors.LinearSegmentedColormap.from_list("cmap", color_scl)
+
+        return cls.__cmap
+
+    @classmethod
+    def __add_map(cls, ax):
+        """
+        Ocean, land, borders, coastlines and gridlines of a map
         """
-        alpha = 0.7
-        color_scl = (
-            [0, (255 / 256, 255 / 256, 255 / 256, alpha)],
-            [0.1, (50 / 256, 95 / 256, 153 / 256, alpha)],
-            [0.2, (99 / 256, 215 / 256, 90 / 256, alpha)],
-            [0.4, (255 / 256, 255 / 256, 84 / 256, alpha)],
-            [0.6, (234 / 256, 51 / 256, 35 / 256, alpha)],
-            [0.8, (159 / 256, 32 / 256, 21 / 256, alpha)],
-            [1.0, (82 / 256, 12 / 256, 6 / 256, alpha)],
+        ax.add_feature(cfeature.OCEAN, facecolor="turquoise", alpha=0.4)
+        ax.add_feature(cfeature.LAND, facecolor="olivedrab", alpha=0.4)
+        ax.add_feature(cfeature.BORDERS, edgecolor="black")
+        ax.coastlines()
+
+        gl = ax.gridlines(
+            crs=ccrs.PlateCarree(), draw_labels=True, x_inline=False, y_inline=False,
+            linewidth=0.33, color="k", alpha=0.5,
         )
+        gl.right_labels = False
+        gl.top_labels = False
 
+    @classmethod
+    def graph_sfr(cls, long, lat, sfr, projection, extent=None, title="SFR"):
+        """
+        Takes in 2d array long, lat, sfr and graphs the satellite data on a world map
+        """
         sfr = sfr[:-1, :-1]
 
-        long = reformat_long(long)
+        long = cls.__positive_long(long)
 
         ax = plt.axes(projection=projection)
         transform = ccrs.PlateCarree()
 
-        cmap = LinearSegmentedColormap.from_list("cmap", color_scl)
+        cmap = cls.colormap()
 
         mesh = plt.pcolormesh(
             long, lat, sfr, cmap=cmap, vmin=np.min(sfr), vmax=np.max(sfr),
@@ -66,29 +106,24 @@ class Grapher:
         if extent is not None:
             ax.set_extent(extent, transform)
 
-        ax.add_feature(cfeature.OCEAN, facecolor="turquoise", alpha=0.4)
-        ax.add_feature(cfeature.LAND, facecolor="olivedrab", alpha=0.4)
-        ax.add_feature(cfeature.BORDERS, edgecolor="black")
-        ax.coastlines()
-
-        gl = ax.gridlines(
-            crs=transform, draw_labels=True, x_inline=False, y_inline=False,
-            linewidth=0.33, color="k", alpha=0.5,
-        )
-        gl.right_labels = False
-        gl.top_labels = False
+        cls.__add_map(ax)
 
         plt.colorbar(mesh, ax=ax)
         plt.title(title)
         plt.show()
 
     @classmethod
-    def graph_df(cls, df: pd.DataFrame, projection, row_len: int=90, extent: list=None, title: str="SFR"):
+    def graph_df(
+        cls, df: pd.DataFrame, projection, row_len: int=None, extent: list=None, title: str="SFR",
+        sensor: str=None
+    ):
         """
-        n20, npp : 96
-        moc, mob, n19 : 90
+        row_len is the fields of view per scanline, taken from the sensor
+        (lib.sensors, n20, npp : 96 moc, mob, n19 : 90) when not given
         """
-        
+        if row_len is None:
+            row_len = get_sensor(sensor).fovs
+
         shape = (int(len(df) / row_len), row_len)
         
         sfr = df.sfr.to_numpy().reshape(shape)
@@ -109,24 +144,203 @@ class Grapher:
         cls.graph_sfr(lon, lat, sfr, projection=projection, extent=extent, title=title)
 
     @classmethod
-    def graph_multiple_nc(cls, files, projection, extent=None, title="SFR"):
+    def graph_multiple_nc(cls, files, projection, extent=None, title="SFR", max_shape: tuple=None):
         """
         Combines multiple satellite swaths and then graph them together as one
-        calls on graph_sfr to perform graphing.
+        calls on graph_sfr to perform graphing. max_shape (scanlines, fovs)
+        decimates the mosaic to about that size, see build_mosaic
         """
 
-        ds = xr.open_dataset(files[0])
-        sfr = ds["SFR"].data
-        lon = ds["Longitude"].data
-        lat = ds["Latitude"].data
+        lon, lat, sfr = cls.build_mosaic(files, max_shape)
+        cls.graph_sfr(lon, lat, sfr, projection=projection, extent=extent, title=title)
+
+    @classmethod
+    def build_mosaic(cls, files, max_shape: tuple=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        lon, lat, sfr of the granules of files stacked along the scanlines,
+        fill values of sfr set to 0. The shapes are read from the file
+        headers first so the mosaic is filled into preallocated arrays. With
+        max_shape (scanlines, fovs) only every n-th scanline and field of
+        view of the whole mosaic is read, the smallest n that fits, so the
+        memory and the number of cells drawn are bounded by max_shape
+        instead of growing with the number of granules
+        """
+        # Shapes from the headers only, without decoding the variables
+        shapes = []
+        for f in files:
+            with netCDF4.Dataset(f) as header:
+                shapes.append(header["SFR"].shape)
+
+        rows = sum(shape[0] for shape in shapes)
+        cols = shapes[0][1]
+        row_step, col_step = 1, 1
+        if max_shape is not None:
+            row_step = max(1, -(-rows // max_shape[0]))
+            col_step = max(1, -(-cols // max_shape[1]))
+
+        # Every row_step-th scanline of the mosaic, counted across granules
+        n_rows = len(range(0, rows, row_step))
+        n_cols = len(range(0, cols, col_step))
+        mosaic = {name: np.empty((n_rows, n_cols), dtype=np.float32) for name in ("Longitude", "Latitude", "SFR")}
+        offset, filled = 0, 0
+
+        for f, shape in zip(files, shapes):
+            if shape[1] != cols:
+                raise ValueError(f"{f} has {shape[1]} fields of view, the mosaic has {cols}")
 
-        for f in files[1:]:
-            ds = xr.open_dataset(f)
+            first = -offset % row_step
+            n = len(range(first, shape[0], row_step))
 
-            sfr = np.concatenate((sfr, ds["SFR"].data), axis=0)
-            lon = np.concatenate((lon, ds["Longitude"].data), axis=0)
-            lat = np.concatenate((lat, ds["Latitude"].data), axis=0)
+            if n != 0:
+                with xr.open_dataset(f) as ds:
+                    for name, values in mosaic.items():
+                        values[filled : filled + n] = ds[name][first::row_step, ::col_step].values
 
+            offset += shape[0]
+            filled += n
+
+        sfr = mosaic["SFR"]
         sfr[sfr == -999] = 0
-        cls.graph_sfr(lon, lat, sfr, projection=projection, extent=extent, title=title)
 
+        return mosaic["Longitude"], mosaic["Latitude"], sfr
+
+    @classmethod
+    def render_batch(
+        cls, items: list, folder: str, projection=None, extent: list=None, vmin: float=0, vmax: float=None,
+        processes: int=1, dpi: int=100
+    ) -> list[str]:
+        """
+        Writes a PNG quick-look of every item into folder without a display.
+        items is a list of (name, data), data is a swath DataFrame (from
+        read_all), a (lon, lat, sfr) tuple of 2d arrays or a
+        CollocatedSiteData (its matched pixels and the station). Items are
+        split over processes, each process prepares the map of projection
+        and extent once and only draws the pixels of every item onto it.
+        All items share the color scale [vmin, vmax] and the extent, which
+        default to the largest SFR and the bounds of all items
+
+        Returns the paths of the images
+        """
+        if projection is None:
+            projection = ccrs.PlateCarree()
+
+        os.makedirs(folder, exist_ok=True)
+        plots = [cls.__plot_data(data) for _, data in items]
+        paths = [os.path.join(folder, f"{name}.png") for name, _ in items]
+        titles = [str(name) for name, _ in items]
+
+        if extent is None:
+            lon = np.concatenate([cls.__positive_long(np.ravel(plot[1])) for plot in plots])
+            lat = np.concatenate([np.ravel(plot[2]) for plot in plots])
+            extent = cls.__proper_bounds(np.nanmin(lon), np.nanmax(lon), np.nanmin(lat), np.nanmax(lat), margin=2)
+        if vmax is None:
+            vmax = max([np.nanmax(plot[3], initial=vmin) for plot in plots], default=vmin)
+            vmax = vmax if vmax > vmin else vmin + 1
+
+        args = [(plot, path, projection, extent, vmin, vmax, title, dpi)
+                for plot, path, title in zip(plots, paths, titles)]
+
+        if processes > 1 and len(args) > 1:
+            with ProcessPoolExecutor(processes) as executor:
+                # Contiguous chunks so every process reuses its template
+                chunksize = max(1, len(args) // (4 * processes))
+                return list(executor.map(cls.render_png, *zip(*args), chunksize=chunksize))
+
+        return [cls.render_png(*arg) for arg in args]
+
+    @classmethod
+    def __positive_long(cls, long: np.ndarray) -> np.ndarray:
+        """
+        reformat_long of an array of any shape without changing it
+        """
+        return np.where(long < 0, long + 360, long)
+
+    @classmethod
+    def __plot_data(cls, data) -> tuple:
+        """
+        ("mesh", lon, lat, sfr) of 2d arrays or ("points", lon, lat, sfr,
+        stations) of pixels and (lon, lat) of stations. Fill values are 0
+        """
+        if isinstance(data, CollocatedSiteData):
+            frames = [frame for frame in data.sat.iter_frames() if not frame.empty]
+            df = pd.concat(frames) if len(frames) != 0 else pd.DataFrame(columns=["longitude", "latitude", "sfr"])
+
+            return ("points", df["longitude"].to_numpy(float), df["latitude"].to_numpy(float),
+                    np.maximum(df["sfr"].to_numpy(float), 0), [(data.lon, data.lat)])
+        elif isinstance(data, pd.DataFrame):
+            return ("points", data["longitude"].to_numpy(float), data["latitude"].to_numpy(float),
+                    np.maximum(data["sfr"].to_numpy(float), 0), [])
+
+        lon, lat, sfr = (np.asarray(a, dtype=float) for a in data)
+
+        return ("mesh", lon, lat, np.where(sfr == -999, 0, sfr))
+
+    @classmethod
+    def map_template(cls, projection, extent: list, vmin: float, vmax: float, dpi: int=100) -> dict:
+        """
+        Figure of a map with its features, gridlines and colorbar drawn once
+        on the Agg canvas (no display). The rendered background is kept so an
+        image only restores it and draws its own pixels and title
+        """
+        key = (projection, tuple(extent) if extent is not None else None, vmin, vmax, dpi)
+
+        if key not in cls.templates:
+            fig = mfigure.Figure(figsize=(8, 6), dpi=dpi)
+            canvas = magg.FigureCanvasAgg(fig)
+            ax = fig.add_subplot(projection=projection)
+            norm = mcolors.Normalize(vmin=vmin, vmax=vmax)
+
+            if extent is not None:
+                ax.set_extent(extent, ccrs.PlateCarree())
+            else:
+                ax.set_global()
+
+            cls.__add_map(ax)
+            fig.colorbar(mcm.ScalarMappable(norm=norm, cmap=cls.colormap()), ax=ax)
+            title = ax.set_title(" ")
+
+            canvas.draw()
+            cls.templates[key] = {"figure": fig, "canvas": canvas, "axes": ax, "norm": norm, "title": title,
+                                  "background": canvas.copy_from_bbox(fig.bbox)}
+
+        return cls.templates[key]
+
+    @classmethod
+    def render_png(
+        cls, plot: tuple, path: str, projection, extent: list, vmin: float, vmax: float, title: str="SFR",
+        dpi: int=100
+    ) -> str:
+        """
+        Draws plot (see __plot_data) onto the map template and writes it to
+        path as a PNG
+        """
+        template = cls.map_template(projection, extent, vmin, vmax, dpi)
+        canvas, ax = template["canvas"], template["axes"]
+        transform = ccrs.PlateCarree()
+
+        canvas.restore_region(template["background"])
+        artists = []
+
+        if plot[0] == "mesh":
+            _, lon, lat, sfr = plot
+            artists.append(ax.pcolormesh(cls.__positive_long(lon), lat, sfr[:-1, :-1], cmap=cls.colormap(),
+                                         norm=template["norm"], transform=transform))
+        else:
+            _, lon, lat, sfr, stations = plot
+            artists.append(ax.scatter(cls.__positive_long(lon), lat, c=sfr, s=4, marker="s", linewidths=0,
+                                      cmap=cls.colormap(), norm=template["norm"], transform=transform))
+            if len(stations) != 0:
+                artists.append(ax.scatter(*zip(*stations), s=40, marker="^", c="black", transform=transform))
+
+        template["title"].set_text(title)
+        artists.append(template["title"])
+
+        for artist in artists:
+            ax.draw_artist(artist)
+
+        mimage.imsave(path, np.asarray(canvas.buffer_rgba()), pil_kwargs={"compress_level": 1})
+
+        for artist in artists[:-1]:
+            artist.remove()
+
+        return path
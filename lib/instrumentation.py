@@ -0,0 +1,119 @@
+from lib import time, os, json
+from contextlib import contextmanager
+import cProfile, pstats, threading
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class RunMetrics:
+    """
+    Wall and cpu timers for every stage of a run, split by satellite when
+    one is given, plus counters and the peak memory of the process. A single
+    stage can be run under cProfile. Stages can be nested, the time of an
+    inner stage is also part of the outer one. Stages that run in another
+    thread add to the same timers, with the satellite of their own thread
+    and the cpu time of that thread only
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self, profile_stage: str=None):
+        self.stages = {}    # dict of stage name:{"wall", "cpu", "calls"}
+        self.counters = {}  # dict of counter name:int
+        self.__local = threading.local()    # Satellite that nested stages are counted under, per thread
+        self.profile_stage = profile_stage
+        self.profiler = cProfile.Profile() if profile_stage is not None else None
+        self.__profile_depth = 0
+        self.__lock = threading.Lock()
+        self.__start = time.perf_counter()
+
+    @property
+    def satellite(self) -> str | None:
+        return getattr(self.__local, "satellite", None)
+
+    @satellite.setter
+    def satellite(self, satellite: str | None):
+        self.__local.satellite = satellite
+
+    @contextmanager
+    def stage(self, name: str, satellite: str=None):
+        """
+        Times the block as stage name. Giving a satellite also counts every
+        stage nested in the block under that satellite
+        """
+        outer_satellite = self.satellite
+        if satellite is not None:
+            self.satellite = satellite
+        key = name if self.satellite is None else f"{name}/{self.satellite}"
+
+        is_profiled = name == self.profile_stage and threading.current_thread() is threading.main_thread()
+        if is_profiled:
+            if self.__profile_depth == 0:
+                self.profiler.enable()
+            self.__profile_depth += 1
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+
+            if is_profiled:
+                self.__profile_depth -= 1
+                if self.__profile_depth == 0:
+                    self.profiler.disable()
+
+            with self.__lock:
+                timer = self.stages.setdefault(key, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+                timer["wall"] += wall
+                timer["cpu"] += cpu
+                timer["calls"] += 1
+
+            self.satellite = outer_satellite
+
+    def count(self, name: str, n: int=1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def peak_rss_mb(self) -> float:
+        if resource is None:
+            return float("nan")
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return rss / 1024**2 if os.uname().sysname == "Darwin" else rss / 1024
+
+    def report(self) -> dict:
+        return {
+            "wall": time.perf_counter() - self.__start,
+            "cpu": time.process_time(),
+            "peak_rss_mb": self.peak_rss_mb(),
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+
+    def to_json(self, folder: str, name: str="run_metrics.json"):
+        """
+        Writes the report into folder and, if a stage was profiled, its
+        profile as profile_<stage>.prof and a text summary
+        """
+        with open(os.path.join(folder, name), "w") as f:
+            json.dump(self.report(), f, indent=4)
+
+        if self.profiler is not None:
+            path = os.path.join(folder, f"profile_{self.profile_stage}")
+            self.profiler.dump_stats(path + ".prof")
+
+            with open(path + ".txt", "w") as f:
+                pstats.Stats(self.profiler, stream=f).sort_stats("cumulative").print_stats(50)
+
+
+# Metrics of the current run, everything in lib records into this
+metrics = RunMetrics()
@@ -0,0 +1,167 @@
+from __future__ import annotations
+from lib import xr, np, pd
+from lib.utilities import reformat_long, km_to_deg
+from lib.snotel_data import CollocatedDataset, CollocatedSiteData
+
+"""
+Reference copies of the implementations that have been replaced by faster
+ones. They are kept as they were so equivalence.py can check the fast paths
+against them, do not optimize them. Module globals of the original code are
+parameters here
+"""
+
+
+def parse_time(year, month, day, hour, minute, sec):
+    if year <= 0 or month <= 0 or day <= 0 or hour < 0 or minute < 0 or sec < 0:
+        return np.datetime64('NaT')
+
+    return "{}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(
+        year, month, day, hour, minute, sec,
+    )
+
+
+def read_satellite_ncdf(file: str | xr.Dataset):
+    if type(file) == str:
+        ds = xr.open_dataset(file)
+    elif type(file) == xr.Dataset:
+        ds = file
+    else:
+        raise ValueError("Incorrect file parameters")
+
+    sfr = ds["SFR"].data
+    lon = ds["Longitude"].data
+    lat = ds["Latitude"].data
+    dim = sfr.shape
+
+    dom = ds["ScanTime_dom"].data.astype("timedelta64[D]").astype(int)
+    hour = ds["ScanTime_hour"].data.astype("timedelta64[h]").astype(int)
+    minute = ds["ScanTime_minute"].data.astype("timedelta64[m]").astype(int)
+    sec = ds["ScanTime_second"].data.astype("timedelta64[s]").astype(int)
+
+    datetime = []
+
+    for i in range(dim[0]):
+        datetime.append([parse_time(ds["ScanTime_year"].data[i],
+                                    ds["ScanTime_month"].data[i],
+                                    dom[i], hour[i], minute[i], sec[i])] * dim[1])
+
+    datetime = np.array(datetime, dtype=np.datetime64)
+
+    df = pd.DataFrame(  # Flatten all
+        {
+            "datetime": datetime.reshape((dim[0] * dim[1],)),
+            "longitude": lon.reshape((dim[0] * dim[1],)),
+            "latitude": lat.reshape((dim[0] * dim[1],)),
+            "sfr": sfr.reshape((dim[0] * dim[1],)),
+        },
+        columns=["datetime", "longitude", "latitude", "sfr"],
+    )
+
+    return df[(df["longitude"] > -180) & (df["latitude"] > -90) & (df["sfr"] >= 0.0)]
+
+
+def spatial_collocation(lon: int, lat: int, sat: pd.DataFrame, box_len_km: float) -> pd.DataFrame:
+    lat_bounds = km_to_deg(sat["latitude"], box_len_km / 2)
+    lon_bounds = km_to_deg(0, box_len_km / 2)
+
+    return sat[
+        (sat["longitude"] < lon + lat_bounds)
+        & (sat["longitude"] > lon - lat_bounds)
+        & (sat["latitude"] < lat + lon_bounds)
+        & (sat["latitude"] > lat - lon_bounds)
+    ]
+
+
+def temporal_colloacation(sntl: pd.DataFrame, t_max: np.datetime64, time_delay: list) -> pd.DataFrame:
+    delta_s = np.timedelta64(time_delay[0], "m")
+    delta_e = np.timedelta64(time_delay[1], "m")
+
+    return sntl[
+        (sntl["Date_Time"] > t_max + delta_s) & (sntl["Date_Time"] < t_max + delta_e)
+    ]
+
+
+def collocate(sntl, sat: pd.DataFrame, box_len_km: float, time_delay: list,
+              coll_data: CollocatedDataset = None) -> CollocatedDataset:
+    if coll_data is None:
+        coll_data = CollocatedDataset()
+
+    for code, site in sntl:
+        coll_sat = spatial_collocation(site.lon, site.lat, sat, box_len_km)
+        coll_sntl = temporal_colloacation(site.hourly, coll_sat["datetime"].max(), time_delay)
+
+        if not coll_sat.empty and not coll_sntl.empty:
+            if not coll_data.has_site(code):
+                coll_data.add_site(CollocatedSiteData(code, site.lon, site.lat))
+
+            coll_data.add_collocated_data(code, coll_sat, coll_sntl)
+
+    return coll_data
+
+
+def reduce_sat_df(df: pd.DataFrame, lon: float, lat: float):
+    re_site_lon = reformat_long(lon)
+
+    if not df.empty:
+        for _, indices in df.groupby(["datetime"]).groups.items():
+            closest_point = None
+            closest_dist = np.inf
+
+            for index in indices:
+                re_sat_lon = reformat_long(df["longitude"][index])
+                dist = (
+                    (re_site_lon - re_sat_lon) ** 2 + (lat - df["latitude"][index]) ** 2
+                ) ** 0.5
+
+                if dist < closest_dist:
+                    closest_point = index
+                    closest_dist = dist
+
+            for index in indices:
+                if index != closest_point:
+                    df.drop(index, inplace=True)
+
+
+def zscore(series):
+    return (series - series.mean()) / series.std()
+
+
+def process_collocated_data(coll, swe: str, temp: str, remove_zero=True):
+    sites_remove = []
+
+    for code, site in coll:
+
+        i = 0
+        while i < len(site):
+            if remove_zero:
+                site.sat[i] = site.sat[i][site.sat[i].sfr != 0]
+            site.sat[i] = site.sat[i][site.sat[i].sfr.notna()]
+            
+            if swe in site.sntl[i].columns:
+                if remove_zero:
+                    site.sntl[i] = site.sntl[i][site.sntl[i][swe] > 0]
+                site.sntl[i] = site.sntl[i][site.sntl[i][swe].notna()]
+                
+                # Make sure swe is snow not rain
+                site.sntl[i] = site.sntl[i][site.sntl[i][temp] < 0]
+            else:
+                site.sntl[i] = site.sntl[i][0:0]
+
+            if site.sat[i].empty or site.sntl[i].empty:
+                site.remove_data(i)
+                i -= 1
+            else:
+                z_score = zscore(site.sat[i].sfr)
+                if not np.isnan(z_score).any():
+                    site.sat[i] = site.sat[i][(z_score < 3) & (z_score > -3)]
+                
+                z_score = zscore(site.sntl[i][swe])
+                if not np.isnan(z_score).any():
+                    site.sntl[i] = site.sntl[i][(z_score < 3) & (z_score > -3)]
+            
+            i += 1
+        if len(site.sat) == 0 or len(site.sntl) == 0:
+            sites_remove.append(code)
+
+    for site in sites_remove:
+        coll.remove_site(site)
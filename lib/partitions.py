@@ -0,0 +1,121 @@
+from lib import os, pickle, json, np, pd
+import hashlib
+
+
+class PartitionStore:
+    """
+    Keeps the collocated data of every finished (satellite, day) partition of
+    a run in a folder so a rerun only has to process partitions that are new
+    or whose input files, snotel hours or config changed. Each partition is a
+    pickle and a json record of the hashes it was made with, both are moved
+    into place atomically and the record is written last so it marks a
+    complete partition
+    """
+
+    # Config keys that change the collocated data of a partition, the snotel
+    # file is hashed per partition (hash_sntl)
+    CONFIG_KEYS = ("sntl-target-data", "BOX-LEN-KM", "TIME-DELAY-RANGE",
+                   "TARGET-CENTER", "SWEEP-BOX-LEN-KM", "SWEEP-TIME-DELAY-RANGE", "COLLOCATION-MODE",
+                   "satellite-sensors", "dedup-pixels")
+
+    # Scan times of the granules of a day folder can run past its end by up to
+    GRANULE_SPAN = np.timedelta64(1, "D")
+
+    def __init__(self, folder: str, config: dict) -> None:
+        self.folder = folder
+        self.config_hash = self.hash_config(config)
+        delays = config.get("SWEEP-TIME-DELAY-RANGE", [config["TIME-DELAY-RANGE"]])
+        self.time_delay = [min(delay[0] for delay in delays), max(delay[1] for delay in delays)]
+
+        os.makedirs(folder, exist_ok=True)
+
+    @classmethod
+    def hash_config(cls, config: dict) -> str:
+        """
+        Hash of the config keys that affect collocation
+        """
+        state = {key: config.get(key) for key in cls.CONFIG_KEYS}
+
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def hash_inputs(cls, path: str) -> str:
+        """
+        Hash of the name, size and modification time of every file in path
+        """
+        h = hashlib.sha256()
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                h.update(f"{os.path.relpath(os.path.join(root, name), path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+
+        return h.hexdigest()
+
+    def hash_sntl(self, sntl, day: str) -> str:
+        """
+        Hash of the snotel sites and of the hours the granules of partition
+        day (8 char date) can be matched with, the hours within the widest
+        delay range of the day and GRANULE_SPAN after it. Refreshing the
+        snotel file with new days then only changes the hash of the partitions
+        next to those days. A partition that is not a day hashes every hour
+        """
+        h = hashlib.sha256()
+        start = stop = None
+
+        if len(day) == 8 and day.isdigit():
+            day_start = np.datetime64(f"{day[:4]}-{day[4:6]}-{day[6:]}")
+            start = day_start + np.timedelta64(self.time_delay[0], "m")
+            stop = day_start + np.timedelta64(1, "D") + self.GRANULE_SPAN + np.timedelta64(self.time_delay[1], "m")
+
+        for code, site in sntl:
+            h.update(repr((code, site.lon, site.lat, site.state, site.elev)).encode())
+            hourly = site.hourly
+
+            if hourly is None:
+                continue
+            elif start is not None:
+                times = hourly["Date_Time"]
+                if times.is_monotonic_increasing:
+                    hourly = hourly.iloc[times.searchsorted(start, side="right"):times.searchsorted(stop)]
+                else:
+                    hourly = hourly[(times > start) & (times < stop)]
+
+            h.update(repr(list(hourly.columns)).encode())
+            h.update(pd.util.hash_pandas_object(hourly, index=False).to_numpy().tobytes())
+
+        return h.hexdigest()
+
+    def __path(self, key: str, extension: str) -> str:
+        return os.path.join(self.folder, f"{key}.{extension}")
+
+    def __replace(self, path: str, mode: str, write):
+        tmp = f"{path}.tmp"
+
+        with open(tmp, mode) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, path)
+
+    def is_complete(self, key: str, input_hash: str, sntl_hash: str) -> bool:
+        try:
+            with open(self.__path(key, "json")) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        return record == {"config": self.config_hash, "inputs": input_hash, "sntl": sntl_hash} \
+            and os.path.exists(self.__path(key, "pickle"))
+
+    def save(self, key: str, data, input_hash: str, sntl_hash: str):
+        self.__replace(self.__path(key, "pickle"), "wb", lambda f: pickle.dump(data, f))
+        self.__replace(self.__path(key, "json"), "w",
+                       lambda f: json.dump({"config": self.config_hash, "inputs": input_hash,
+                                            "sntl": sntl_hash}, f))
+
+    def load(self, key: str):
+        with open(self.__path(key, "pickle"), "rb") as f:
+            return pickle.load(f)
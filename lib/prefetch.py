@@ -0,0 +1,69 @@
+from lib.instrumentation import metrics
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+
+class Prefetcher:
+    """
+    Iterates over the results of load(item) for every item in order while
+    the next depth items are already loading in background threads, so the
+    reads of upcoming granules overlap with decoding and collocating the
+    current one. At most depth loads are in flight or waiting to be taken,
+    which bounds the memory to depth loaded granules. Exceptions of load are
+    raised when their item is taken. The time spent waiting on a load that
+    was not done yet is the stage "io_wait", the loads themselves the stage
+    "prefetch", under the satellite of the stage the item was queued in
+    """
+
+    def __init__(self, load, items, depth: int) -> None:
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+
+        self.load = load
+        self.items = iter(items)
+        self.depth = depth
+        self.pending = deque()  # futures in item order
+        self.executor = ThreadPoolExecutor(max_workers=depth, thread_name_prefix="prefetch")
+        self.__fill()
+
+    def __load(self, item, satellite: str):
+        with metrics.stage("prefetch", satellite):
+            return self.load(item)
+
+    def __fill(self):
+        while len(self.pending) < self.depth:
+            item = next(self.items, None)
+            if item is None:
+                break
+
+            self.pending.append(self.executor.submit(self.__load, item, metrics.satellite))
+            metrics.count("granules_prefetched")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.pending:
+            self.close()
+            raise StopIteration
+
+        future = self.pending.popleft()
+        self.__fill()
+
+        with metrics.stage("io_wait"):
+            return future.result()
+
+    def close(self):
+        """
+        Cancels the loads that have not started and waits for running ones
+        """
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,101 @@
+LAYOUTS = ("tiny", "swath", "orbit")
+FORMATS = ("netcdf", "hdf5")
+
+
+class Sensor:
+    """
+    Reader plugin of the granules of one satellite of "satellite-directories".
+    Declares the file format, the scan geometry and the layout of the
+    granules, which decides how they are turned into swaths around the center:
+        "tiny"  few scanline granules built up into swaths (assemble_orbits)
+        "swath" granules that each cover the region, read whole when their
+                first scanline contains the center
+        "orbit" big granules (whole orbits) cut around the center (localize_sat)
+        None    picked per granule from its number of scanlines
+    A granule whose number of scanlines does not fit the declared layout is
+    read with the layout of its scanlines
+
+    fovs: fields of view per scanline
+    row_per_swath: scanlines kept around the center of an orbit granule
+    granule_window: granules kept on each side of a tiny granule in bounds
+    tiny_rows, orbit_rows: granules with fewer scanlines than tiny_rows are
+        tiny, more than orbit_rows are orbits
+    """
+
+    def __init__(
+        self, name: str, format: str="netcdf", layout: str=None, fovs: int=90, row_per_swath: int=192,
+        granule_window: int=8, tiny_rows: int=21, orbit_rows: int=700
+    ) -> None:
+        if format not in FORMATS:
+            raise ValueError(f"format can only be one of {FORMATS}")
+        if layout is not None and layout not in LAYOUTS:
+            raise ValueError(f"layout can only be one of {LAYOUTS} or None")
+
+        self.name = name
+        self.format = format
+        self.layout = layout
+        self.fovs = fovs
+        self.row_per_swath = row_per_swath
+        self.granule_window = granule_window
+        self.tiny_rows = tiny_rows
+        self.orbit_rows = orbit_rows
+        self.extension = "h5" if format == "hdf5" else None   # netcdf folders are read whole
+        self.__layouts = {}     # Lookup of number of scanlines:layout
+
+    def layout_of(self, rows: int) -> str | None:
+        """
+        Layout a granule of rows scanlines is read with, None if it is
+        skipped (exactly orbit_rows scanlines, as read_all always did)
+        """
+        if rows not in self.__layouts:
+            if rows >= self.tiny_rows - 1 and rows < self.orbit_rows:
+                detected = "swath"
+            elif rows > self.orbit_rows:
+                detected = "orbit"
+            elif rows < self.tiny_rows:
+                detected = "tiny"
+            else:
+                detected = None
+
+            is_declared = ((self.layout == "tiny" and rows < self.tiny_rows)
+                           or (self.layout == "swath" and self.tiny_rows - 1 <= rows < self.orbit_rows)
+                           or (self.layout == "orbit" and rows > self.orbit_rows))
+            self.__layouts[rows] = self.layout if is_declared else detected
+
+        return self.__layouts[rows]
+
+    def __repr__(self) -> str:
+        return f"Sensor({self.name!r}, format={self.format!r}, layout={self.layout!r}, fovs={self.fovs})"
+
+
+# Sensors of the satellite names used in "satellite-directories"
+SENSORS = {}
+
+
+def register_sensor(sensor: Sensor) -> Sensor:
+    """
+    Adds or replaces the reader plugin of sensor.name
+    """
+    SENSORS[sensor.name] = sensor
+
+    return sensor
+
+
+def get_sensor(name: str | Sensor | None) -> Sensor:
+    """
+    Registered sensor of a satellite name. Unknown names and None get a
+    sensor that picks the layout of every granule from its scanlines
+    """
+    if isinstance(name, Sensor):
+        return name
+    elif name in SENSORS:
+        return SENSORS[name]
+
+    return Sensor(name)
+
+
+# Built in sensors, can be replaced with "satellite-sensors" in the config
+for name in ("npp", "n20"):     # ATMS
+    register_sensor(Sensor(name, layout="tiny", fovs=96))
+for name in ("moc", "mob", "n19"):  # AMSU-A/MHS
+    register_sensor(Sensor(name, layout="orbit", fovs=90))
@@ -1,4 +1,6 @@
-from lib import pd, os
+from lib import pd, np, os
+from collections.abc import MutableSequence
+import copy
 
 
 class SnotelSiteData:
@@ -92,30 +94,165 @@ class SnotelDataset:
             return list(self.data_sets.items())[self.__index]
 
 
+class FrameSlice:
+    """
+    Rows of a retained DataFrame (a swath or a site's hourly data) that a
+    match is made of, kept as positions or a [start, stop) slice instead of a
+    copy. Matches of the same swath or site share the retained frame
+    """
+
+    def __init__(self, frame: pd.DataFrame, index: np.ndarray | slice) -> None:
+        self.frame = frame
+        self.index = index
+
+    def materialize(self) -> pd.DataFrame:
+        if isinstance(self.index, slice):
+            return self.frame.iloc[self.index].copy()
+
+        return self.frame.take(self.index)
+
+    def positions(self) -> np.ndarray:
+        if isinstance(self.index, slice):
+            return np.arange(self.index.start, self.index.stop)
+
+        return self.index
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def __len__(self) -> int:
+        if isinstance(self.index, slice):
+            return max(0, self.index.stop - self.index.start)
+
+        return len(self.index)
+
+    @classmethod
+    def compact(cls, frame_slices: list) -> dict:
+        """
+        Cuts every retained frame down to the rows its slices point to so only
+        those are pickled. Returns dict of id(FrameSlice):FrameSlice into the
+        compacted frames, slices stay slices since every row in between is kept
+        """
+        groups = {}  # dict of id(frame):(frame, [FrameSlice])
+
+        for frame_slice in frame_slices:
+            groups.setdefault(id(frame_slice.frame), (frame_slice.frame, []))[1].append(frame_slice)
+
+        compacted = {}
+
+        for frame, members in groups.values():
+            positions = [member.positions() for member in members]
+            rows = np.unique(np.concatenate(positions))
+            frame = frame.iloc[rows]
+            dtype = np.int32 if len(rows) < 2**31 else np.int64
+
+            for member, position in zip(members, positions):
+                position = np.searchsorted(rows, position).astype(dtype)
+
+                if isinstance(member.index, slice):
+                    index = slice(int(position[0]), int(position[-1]) + 1)
+                else:
+                    index = position
+                compacted[id(member)] = FrameSlice(frame, index)
+
+        return compacted
+
+
+class MatchFrames(MutableSequence):
+    """
+    List of the satellite or snotel DataFrames of the matches of a site.
+    Entries can be DataFrames or FrameSlices, a FrameSlice is materialized
+    into a DataFrame that replaces it the first time it is accessed, so
+    accessed frames can be changed in place. frames holds the stored entries
+    """
+
+    def __init__(self, frames=()) -> None:
+        self.frames = list(frames)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.__materialize(j) for j in range(len(self.frames))[i]]
+
+        return self.__materialize(i)
+
+    def __materialize(self, i: int) -> pd.DataFrame:
+        if isinstance(self.frames[i], FrameSlice):
+            self.frames[i] = self.frames[i].materialize()
+
+        return self.frames[i]
+
+    def __setitem__(self, i, frame):
+        self.frames[i] = frame
+
+    def __delitem__(self, i):
+        del self.frames[i]
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def iter_frames(self):
+        """
+        The frames materialized without replacing the stored FrameSlices, for
+        passes that only read the matches. Keeps the matches as references so
+        they are still compacted when pickled
+        """
+        return (frame.materialize() if isinstance(frame, FrameSlice) else frame for frame in self.frames)
+
+    def insert(self, i, frame):
+        self.frames.insert(i, frame)
+
+    def __repr__(self) -> str:
+        return repr(self[:])
+
+
 class CollocatedSiteData:
     def __init__(
         self,
         site_code: int | str,
         lon: float,
         lat: float,
+        state: str = None,
+        elev: float = None,
     ) -> None:
         self.site_code = site_code
         self.lon = lon
         self.lat = lat
+        self.state = state
+        self.elev = elev
         self.sat = []
         self.sntl = []
+        self.meta = []  # dict of satellite, datetime for every match
         self.__index = -1
 
-    def add_data(self, sat: pd.DataFrame, sntl: pd.DataFrame):
+    @property
+    def sat(self) -> MatchFrames:
+        return self.__sat
+
+    @sat.setter
+    def sat(self, frames):
+        self.__sat = frames if isinstance(frames, MatchFrames) else MatchFrames(frames)
+
+    @property
+    def sntl(self) -> MatchFrames:
+        return self.__sntl
+
+    @sntl.setter
+    def sntl(self, frames):
+        self.__sntl = frames if isinstance(frames, MatchFrames) else MatchFrames(frames)
+
+    def add_data(self, sat: pd.DataFrame | FrameSlice, sntl: pd.DataFrame | FrameSlice, meta: dict = None):
         if sat is None or sntl is None or sat.empty or sntl.empty:
             raise ValueError("Satellite and Snotel DataFrames can not be None or empty")
 
         self.sat.append(sat)
         self.sntl.append(sntl)
+        self.meta.append({} if meta is None else meta)
 
     def remove_data(self, index: int):
         self.sat.pop(index)
         self.sntl.pop(index)
+        self.meta.pop(index)
 
     def to_csv(self, path: str):
         path = os.path.join(path, str(self.site_code))
@@ -132,10 +269,10 @@ class CollocatedSiteData:
     def get_sat_column(self, column: str) -> list:
         elements = []
 
-        if column in self.sat[0].columns:
-            elements = self.sat[0][column].tolist()
+        frames = list(self.sat.iter_frames())
 
-            for sat in self.sat[1:]:
+        if column in frames[0].columns:
+            for sat in frames:
                 elements.extend(sat[column].tolist())
 
         return elements
@@ -143,10 +280,10 @@ class CollocatedSiteData:
     def get_sntl_column(self, column: str) -> list:
         elements = []
 
-        if column in self.sntl[0].columns:
-            elements = self.sntl[0][column].tolist()
+        frames = list(self.sntl.iter_frames())
 
-            for sntl in self.sntl[1:]:
+        if column in frames[0].columns:
+            for sntl in frames:
                 elements.extend(sntl[column].tolist())
 
         return elements
@@ -163,6 +300,19 @@ class CollocatedSiteData:
     def __len__(self) -> int:
         return len(self.sat)
 
+    def __setstate__(self, state: dict):
+        # Pickles made before matches were kept as MatchFrames
+        if "sat" in state:
+            state["_CollocatedSiteData__sat"] = MatchFrames(state.pop("sat"))
+            state["_CollocatedSiteData__sntl"] = MatchFrames(state.pop("sntl"))
+
+        # Pickles made before match metadata was kept
+        state.setdefault("state", None)
+        state.setdefault("elev", None)
+        if "meta" not in state:
+            state["meta"] = [{} for _ in range(len(state["_CollocatedSiteData__sat"]))]
+        self.__dict__.update(state)
+
     def __getitem__(self, __i):
         return [self.sntl.__getitem__(__i), self.sat.__getitem__(__i)]
 
@@ -192,15 +342,51 @@ class CollocatedDataset:
     def remove_site(self, site: int):
         self.data.pop(site)
 
-    def add_collocated_data(self, site: int, sat: pd.DataFrame, sntl: pd.DataFrame):
+    def add_collocated_data(self, site: int, sat: pd.DataFrame | FrameSlice, sntl: pd.DataFrame | FrameSlice,
+                            meta: dict = None):
         if site in self.data:
-            self.data[site].add_data(sat, sntl)
+            self.data[site].add_data(sat, sntl, meta)
         else:
             raise ValueError("Site does not exist, you need to create it first")
     
     def has_site(self, site: int):
         return site in self.data
 
+    def __getstate__(self) -> dict:
+        """
+        Pickles only the rows of the retained swaths and hourly data that the
+        matches point to
+        """
+        state = self.__dict__.copy()
+        frame_slices = [frame for site in self.data.values() for frames in (site.sat, site.sntl)
+                        for frame in frames.frames if isinstance(frame, FrameSlice)]
+
+        if len(frame_slices) != 0:
+            compacted = FrameSlice.compact(frame_slices)
+            state["data"] = {}
+
+            for code, site in self.data.items():
+                site = copy.copy(site)
+                site.sat = [compacted.get(id(frame), frame) for frame in site.sat.frames]
+                site.sntl = [compacted.get(id(frame), frame) for frame in site.sntl.frames]
+                state["data"][code] = site
+
+        return state
+
+    def merge(self, other):
+        """
+        Appends the matches of another CollocatedDataset, sites that are not
+        in this dataset are added
+        """
+        for code, site in other:
+            if not self.has_site(code):
+                self.add_site(CollocatedSiteData(code, site.lon, site.lat, site.state, site.elev))
+
+            for sat, sntl, meta in zip(site.sat.frames, site.sntl.frames, site.meta):
+                self.add_collocated_data(code, sat, sntl, meta)
+
+        return self
+
     def to_csv(self, path: str, package_name: str):
         package_path = os.path.join(path, package_name)
         os.makedirs(package_path)
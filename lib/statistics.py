@@ -1,4 +1,6 @@
-from lib import np
+from lib import np, pd, json
+from concurrent.futures import ProcessPoolExecutor
+import math, warnings
 
 class Statistics:
     """
@@ -52,52 +54,117 @@ class Statistics:
         for _, site in coll:
             self.remove_site_invalid_temp(site)
 
-    # ! Change this function into two like above one for site one for dataset
-    def process_collocated_data(self, coll, remove_zero=True):
+    def __group_zscore_outliers(self, values, ids, keep, n):
         """
-        This function preforms the quality control and prepares the data for 
-        statistical calculations. 
-        1. Removes all NaNs
-        2. Removes all 0s 
+        Finds the rows that are not within 3 zscores of the mean of their match.
+        values and ids are the flattened rows of every match and keep masks the
+        rows that are still in. Matches where a zscore is NaN are not clipped
         """
-        sites_remove = []
+        outliers = np.zeros(len(values), dtype=bool)
+        v = values[keep]
+        g = ids[keep]
 
-        for code, site in coll:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            count = np.bincount(g, minlength=n)
+            mean = np.bincount(g, weights=v, minlength=n) / count
+            dev = v - mean[g]
+            std = np.sqrt(np.bincount(g, weights=dev**2, minlength=n) / (count - 1))
+            z_score = dev / std[g]
 
-            i = 0
-            while i < len(site):    # Could be changed into for loop by changing the deletion to iterate the index list
-                if remove_zero:
-                    site.sat[i] = site.sat[i][site.sat[i].sfr != 0]
-                site.sat[i] = site.sat[i][site.sat[i].sfr.notna()]
-                
-                if self.swe in site.sntl[i].columns:
-                    if remove_zero:
-                        site.sntl[i] = site.sntl[i][site.sntl[i][self.swe] > 0]
-                    site.sntl[i] = site.sntl[i][site.sntl[i][self.swe].notna()]
-                    
-                    # Make sure swe is snow not rain
-                    site.sntl[i] = site.sntl[i][site.sntl[i][self.temp] < 0]
-                else:
-                    site.sntl[i] = site.sntl[i][0:0]
+        has_nan = np.bincount(g, weights=np.isnan(z_score), minlength=n) > 0
+        outliers[keep] = ~has_nan[g] & ~((z_score < 3) & (z_score > -3))
 
-                if site.sat[i].empty or site.sntl[i].empty:
-                    site.remove_data(i)
-                    i -= 1
-                else:
-                    z_score = self.__zscore(site.sat[i].sfr)
-                    if not np.isnan(z_score).any():
-                        site.sat[i] = site.sat[i][(z_score < 3) & (z_score > -3)]
-                    
-                    z_score = self.__zscore(site.sntl[i][self.swe])
-                    if not np.isnan(z_score).any():
-                        site.sntl[i] = site.sntl[i][(z_score < 3) & (z_score > -3)]
-                
+        return outliers
+
+    def process_collocated_data(self, coll, remove_zero=True) -> dict:
+        """
+        This function preforms the quality control and prepares the data for 
+        statistical calculations. The rules are applied as masks over the rows
+        of every match at once, in order:
+        1. Removes all 0s
+        2. Removes all NaNs
+        3. Removes snotel rows that are not below 0 degrees (rain not snow)
+        4. Removes matches that are left empty and sites left with no matches
+        5. Removes values outside of 3 zscores of their match
+
+        Returns a report of how many rows, matches and sites each rule dropped
+        """
+        report = {"zero_sfr": 0, "nan_sfr": 0, "missing_swe": 0, "zero_swe": 0,
+                  "nan_swe": 0, "warm_temp": 0, "sfr_outlier": 0, "swe_outlier": 0,
+                  "empty_matches": 0, "empty_sites": 0}
+
+        sites = [(code, site) for code, site in coll]
+        sats = [sat for _, site in sites for sat in site.sat.iter_frames()]
+        sntls = [sntl for _, site in sites for sntl in site.sntl.iter_frames()]
+        n = len(sats)
+
+        if n != 0:
+            has_swe = np.array([self.swe in sntl.columns for sntl in sntls])
+            sat_len = np.array([len(sat) for sat in sats])
+            sntl_len = np.array([len(sntl) for sntl in sntls])
+            sat_ids = np.repeat(np.arange(n), sat_len)
+            sntl_ids = np.repeat(np.arange(n), sntl_len)
+
+            # Flatten every match into one array per column
+            sfr = np.concatenate([sat.sfr.to_numpy(dtype=float) for sat in sats])
+            swe = np.concatenate([sntl[self.swe].to_numpy(dtype=float) if has_swe[i]
+                                  else np.full(len(sntl), np.NaN) for i, sntl in enumerate(sntls)])
+            temp = np.concatenate([sntl[self.temp].to_numpy(dtype=float) if has_swe[i]
+                                   else np.full(len(sntl), np.NaN) for i, sntl in enumerate(sntls)])
+
+            def drop(keep, mask, rule):
+                mask = keep & mask
+                report[rule] += int(mask.sum())
+                return keep & ~mask
+
+            sat_keep = np.ones(len(sfr), dtype=bool)
+            if remove_zero:
+                sat_keep = drop(sat_keep, sfr == 0, "zero_sfr")
+            sat_keep = drop(sat_keep, np.isnan(sfr), "nan_sfr")
+
+            sntl_keep = np.ones(len(swe), dtype=bool)
+            sntl_keep = drop(sntl_keep, ~has_swe[sntl_ids], "missing_swe")
+            if remove_zero:
+                sntl_keep = drop(sntl_keep, ~(swe > 0), "zero_swe")
+            sntl_keep = drop(sntl_keep, np.isnan(swe), "nan_swe")
+            sntl_keep = drop(sntl_keep, ~(temp < 0), "warm_temp")
+
+            is_empty = ((np.bincount(sat_ids[sat_keep], minlength=n) == 0)
+                        | (np.bincount(sntl_ids[sntl_keep], minlength=n) == 0))
+            report["empty_matches"] = int(is_empty.sum())
+            sat_keep &= ~is_empty[sat_ids]
+            sntl_keep &= ~is_empty[sntl_ids]
+
+            sat_keep = drop(sat_keep, self.__group_zscore_outliers(sfr, sat_ids, sat_keep, n), "sfr_outlier")
+            sntl_keep = drop(sntl_keep, self.__group_zscore_outliers(swe, sntl_ids, sntl_keep, n), "swe_outlier")
+
+            sat_offsets = np.concatenate(([0], np.cumsum(sat_len)))
+            sntl_offsets = np.concatenate(([0], np.cumsum(sntl_len)))
+
+        # Rebuild every site from the masks, one slice per match
+        i = 0
+        for code, site in sites:
+            kept_sat = []
+            kept_sntl = []
+
+            kept_meta = []
+
+            for meta in site.meta:
+                if not is_empty[i]:
+                    kept_sat.append(sats[i][sat_keep[sat_offsets[i]:sat_offsets[i + 1]]])
+                    kept_sntl.append(sntls[i][sntl_keep[sntl_offsets[i]:sntl_offsets[i + 1]]])
+                    kept_meta.append(meta)
                 i += 1
+
+            site.sat = kept_sat
+            site.sntl = kept_sntl
+            site.meta = kept_meta
+
             if len(site.sat) == 0 or len(site.sntl) == 0:
-                sites_remove.append(code)
+                report["empty_sites"] += 1
+                coll.remove_site(code)
 
-        for site in sites_remove:
-            coll.remove_site(site)
+        return report
 
     def np_site_mean(self, site):
         sfr = np.array(site.get_sat_column("sfr"))
@@ -308,16 +375,19 @@ class Statistics:
             return np.NaN
         return (mse / count)**0.5
 
-    def POD(self, cm) -> float:
+    @staticmethod
+    def POD(cm) -> float:
         return cm[0][0] / (cm[0][0] + cm[1][0])
 
-    def FAR(self, cm) -> float:
+    @staticmethod
+    def FAR(cm) -> float:
         """
         False Alarm Rate
         """
         return cm[0][1] / (cm[0][1] + cm[1][1])
 
-    def HSS(self, cm) -> float:
+    @staticmethod
+    def HSS(cm) -> float:
         return 2 * (cm[0][0] * cm[1][1] - cm[1][0] * cm[0][1]) / ((cm[0][0] + cm[1][0]) * (cm[1][0] + cm[1][1]) + (cm[0][0] + cm[0][1]) * (cm[0][1] + cm[1][1]))
 
     def site_confusion_matrix(self, site, sat_thres=0.2, sntl_thres=2.54) -> list[list[int]]:
@@ -360,3 +430,431 @@ class Statistics:
 
         return cm
 
+    def match_table(self, coll) -> pd.DataFrame:
+        """
+        Reduces every match of the collocated dataset to one row of counts, 
+        sums, means and maxima (see reduce_match) so metrics can be calculated
+        with array operations instead of going through the DataFrames again
+        """
+        rows = []
+
+        for code, site in coll:
+            for i, (sat, sntl) in enumerate(site):
+                row = reduce_match(sat, sntl, self.swe)
+                row.update(site=code, state=site.state, elev=site.elev,
+                           satellite=site.meta[i].get("satellite"),
+                           datetime=site.meta[i].get("datetime", pd.NaT),
+                           temp=sntl[self.temp].mean() if self.temp in sntl.columns else np.NaN)
+                rows.append(row)
+
+        return pd.DataFrame(rows, columns=["site", "state", "elev", "satellite", "datetime", "temp",
+                                           "sfr_sum", "sfr_count", "swe_sum", "swe_count",
+                                           "n", "x", "y", "sfr_max", "swe_max"])
+
+    def __table(self, coll) -> pd.DataFrame:
+        """
+        coll can be a collocated dataset or a table made by match_table or
+        collocation.pair_collocated
+        """
+        return coll if isinstance(coll, pd.DataFrame) else self.match_table(coll)
+
+    def stratified(self, coll, by=("satellite",), elev_bins=(0, 500, 1000, 1500, 2000, 3000, 5000),
+                   temp_bins=(-np.inf, -15, -10, -5, 0), sat_thres=0.2, sntl_thres=2.54) -> pd.DataFrame:
+        """
+        Calculates every metric for each group of matches in one grouped pass
+        over the match table. by can be any combination of the match table
+        columns (site, state, satellite, ...) and of
+            month: month of the swath time
+            elev_band: site elevation binned by elev_bins
+            temp_band: mean snotel temperature of the match binned by temp_bins
+
+        Returns DataFrame indexed by the group keys with columns matches, bias,
+        corr, rmse, pod, far, hss. coll can also be a match or pair table
+        """
+        table = self.__table(coll).copy()
+        by = list(by)
+
+        table["month"] = pd.to_datetime(table.datetime).dt.month
+        table["elev_band"] = pd.cut(table.elev.astype(float), elev_bins)
+        table["temp_band"] = pd.cut(table.temp, temp_bins)
+
+        sat_detected = table.sfr_max > sat_thres
+        sntl_detected = table.swe_max > sntl_thres
+        table["xx_sum"] = table.x * table.x
+        table["yy_sum"] = table.y * table.y
+        table["xy_sum"] = table.x * table.y
+        table["sq_err_sum"] = (table.x - table.y)**2
+        table["hits"] = sat_detected & sntl_detected
+        table["false_alarms"] = sat_detected & ~sntl_detected
+        table["misses"] = ~sat_detected & sntl_detected
+        table["correct_negatives"] = ~sat_detected & ~sntl_detected
+        table = table.rename(columns={"x": "x_sum", "y": "y_sum"})
+
+        columns = ["sfr_sum", "sfr_count", "swe_sum", "swe_count", "n", "x_sum", "y_sum",
+                   "xx_sum", "yy_sum", "xy_sum", "sq_err_sum",
+                   "hits", "false_alarms", "misses", "correct_negatives"]
+        sums = table.groupby(by, observed=True, dropna=False)[columns].sum()
+
+        bias, corr, rmse = metrics_from_sums({column: sums[column].to_numpy() for column in columns})
+        cm = [[sums.hits.to_numpy(), sums.false_alarms.to_numpy()],
+              [sums.misses.to_numpy(), sums.correct_negatives.to_numpy()]]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return pd.DataFrame({"matches": sums[columns[-4:]].sum(axis=1), "bias": bias,
+                                 "corr": corr, "rmse": rmse, "pod": self.POD(cm),
+                                 "far": self.FAR(cm), "hss": self.HSS(cm)}, index=sums.index)
+
+    def threshold_sweep(self, coll, sat_thres=None, sntl_thres=None) -> dict:
+        """
+        Confusion matrix metrics for every combination of satellite and snotel
+        thresholds. Each match is reduced to its max sfr and max swe once, then
+        binned against the sorted thresholds and the cells of every grid point
+        come from reverse cumulative sums of that 2d histogram. Thresholds
+        default to every distinct max so the grid is complete
+
+        Returns dict of the sorted thresholds and (sat, sntl) shaped arrays of
+        hits, false_alarms, misses, correct_negatives, pod, far and hss
+        """
+        table = self.__table(coll)
+        sfr_max = table.sfr_max.to_numpy(dtype=float)
+        swe_max = table.swe_max.to_numpy(dtype=float)
+
+        if sat_thres is None:
+            sat_thres = sfr_max[~np.isnan(sfr_max)]
+        if sntl_thres is None:
+            sntl_thres = swe_max[~np.isnan(swe_max)]
+        sat_thres = np.unique(np.asarray(sat_thres, dtype=float))
+        sntl_thres = np.unique(np.asarray(sntl_thres, dtype=float))
+
+        # Number of thresholds each max is above, NaN is never detected
+        sat_bins = np.where(np.isnan(sfr_max), 0, np.searchsorted(sat_thres, sfr_max, side="left"))
+        sntl_bins = np.where(np.isnan(swe_max), 0, np.searchsorted(sntl_thres, swe_max, side="left"))
+
+        shape = (len(sat_thres) + 1, len(sntl_thres) + 1)
+        hist = np.bincount(sat_bins * shape[1] + sntl_bins, minlength=shape[0] * shape[1]).reshape(shape)
+        above = hist[::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+
+        hits = above[1:, 1:]
+        false_alarms = above[1:, :1] - hits
+        misses = above[:1, 1:] - hits
+        correct_negatives = len(table) - hits - false_alarms - misses
+        cm = [[hits, false_alarms], [misses, correct_negatives]]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {"sat_thres": sat_thres, "sntl_thres": sntl_thres,
+                    "hits": hits, "false_alarms": false_alarms, "misses": misses,
+                    "correct_negatives": correct_negatives,
+                    "pod": self.POD(cm), "far": self.FAR(cm), "hss": self.HSS(cm)}
+
+    def bootstrap(self, coll, replicates=1000, batch_size=100, seed=None, processes=1,
+                  alpha=0.05, sat_thres=0.2, sntl_thres=2.54) -> dict:
+        """
+        Bootstrap confidence intervals of bias, corr, rmse, POD, FAR and HSS
+        globally and per site. Matches are resampled with replacement in 
+        batches of batch_size replicates, processes > 1 spreads the batches
+        over a process pool. The same seed gives the same intervals for any
+        number of processes
+
+        Returns {"global": {metric: (low, high)}, site code: {...}, ...}
+        """
+        table = self.__table(coll)
+        groups = {"global": table}
+        groups.update({code: rows for code, rows in table.groupby("site", sort=False)})
+
+        batches = [min(batch_size, replicates - i) for i in range(0, replicates, batch_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(groups) * len(batches))
+        tasks = []
+
+        for key, rows in groups.items():
+            if len(rows) == 0:
+                continue
+            columns = {column: rows[column].to_numpy(dtype=float) for column in
+                       ("sfr_sum", "sfr_count", "swe_sum", "swe_count", "n", "x", "y", "sfr_max", "swe_max")}
+            for size in batches:
+                tasks.append((key, (columns, size, seeds[len(tasks)], sat_thres, sntl_thres)))
+
+        if processes > 1:
+            with ProcessPoolExecutor(processes) as pool:
+                results = list(pool.map(_bootstrap_batch, *zip(*[args for _, args in tasks])))
+        else:
+            results = [_bootstrap_batch(*args) for _, args in tasks]
+
+        replicated = {}
+        for (key, _), result in zip(tasks, results):
+            replicated.setdefault(key, []).append(result)
+
+        intervals = {}
+        for key, batch_results in replicated.items():
+            intervals[key] = {}
+            for metric in batch_results[0]:
+                values = np.concatenate([result[metric] for result in batch_results])
+                if np.isnan(values).all():
+                    intervals[key][metric] = (np.NaN, np.NaN)
+                else:
+                    low, high = np.nanpercentile(values, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+                    intervals[key][metric] = (float(low), float(high))
+
+        return intervals
+
+
+
+def _add_partial(partials: list, x: float):
+    """
+    Adds x to a list of non overlapping partial sums (Shewchuk's algorithm)
+    so that math.fsum(partials) is the exactly rounded total no matter the
+    order the values were added or merged in
+    """
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x + y
+        lo = y - (hi - x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
+
+
+def metrics_from_sums(sums) -> tuple:
+    """
+    Calculates bias, correlation and rmse from the sums kept by a
+    StatisticsAccumulator. The sums can be scalars or arrays of sums of
+    several groups. Correlation is taken between the match means around the
+    row means, same as Statistics.correlation
+
+    Returns bias, corr, rmse
+    """
+    s = {key: np.asarray(value, dtype=float) for key, value in sums.items()}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sfr_mean = s["sfr_sum"] / s["sfr_count"]
+        swe_mean = s["swe_sum"] / s["swe_count"]
+
+        top = (s["xy_sum"] - swe_mean * s["x_sum"] - sfr_mean * s["y_sum"]
+               + s["n"] * sfr_mean * swe_mean)
+        x_diff = np.maximum(s["xx_sum"] - 2 * sfr_mean * s["x_sum"] + s["n"] * sfr_mean**2, 0)
+        y_diff = np.maximum(s["yy_sum"] - 2 * swe_mean * s["y_sum"] + s["n"] * swe_mean**2, 0)
+        bottom = (x_diff * y_diff)**0.5
+
+        corr = np.where(bottom == 0, np.NaN, top / bottom)
+        rmse = np.where(s["n"] == 0, np.NaN, (s["sq_err_sum"] / s["n"])**0.5)
+
+    return (sfr_mean - swe_mean)[()], corr[()], rmse[()]
+
+
+def reduce_match(sat, sntl, target_data: str) -> dict:
+    """
+    Reduces one collocated match to the counts, sums, means and maxima that
+    every statistic is calculated from. x and y are the match means used by
+    correlation and rmse, they only count (n = 1) if the snotel frame has
+    target data that is not all NaN, otherwise they are 0. Maxima are NaN
+    when there is no value
+    """
+    sfr = sat.sfr.to_numpy(dtype=float)
+    match = {"sfr_sum": np.nansum(sfr), "sfr_count": len(sfr), "swe_sum": 0.0, "swe_count": 0,
+             "n": 0, "x": 0.0, "y": 0.0, "sfr_max": np.NaN, "swe_max": np.NaN}
+
+    with np.errstate(invalid="ignore"), warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+
+        if len(sfr) != 0:
+            match["sfr_max"] = np.nanmax(sfr)
+
+        if target_data in sntl.columns:
+            swe = sntl[target_data].to_numpy(dtype=float)
+            match["swe_sum"] = np.nansum(swe)
+            match["swe_count"] = len(swe)
+
+            if not np.isnan(swe).all():
+                match["n"] = 1
+                match["x"] = np.nanmean(sfr)
+                match["y"] = np.nanmean(swe)
+                match["swe_max"] = np.nanmax(swe)
+
+    return match
+
+
+def _bootstrap_batch(table: dict, replicates: int, seed, sat_thres: float, sntl_thres: float) -> dict:
+    """
+    Calculates every metric for a batch of bootstrap replicates of the
+    matches in table. Matches are resampled as an index array so each
+    replicate is a row of sums over the gathered columns
+    """
+    rng = np.random.default_rng(seed)
+    n = len(table["n"])
+    idx = rng.integers(0, n, size=(replicates, n))
+
+    sat_detected = table["sfr_max"] > sat_thres
+    sntl_detected = table["swe_max"] > sntl_thres
+
+    x = table["x"]
+    y = table["y"]
+    columns = {
+        "sfr_sum": table["sfr_sum"], "sfr_count": table["sfr_count"],
+        "swe_sum": table["swe_sum"], "swe_count": table["swe_count"], "n": table["n"],
+        "x_sum": x, "y_sum": y, "xx_sum": x * x, "yy_sum": y * y, "xy_sum": x * y,
+        "sq_err_sum": (x - y)**2,
+        "hits": sat_detected & sntl_detected, "false_alarms": sat_detected & ~sntl_detected,
+        "misses": ~sat_detected & sntl_detected, "correct_negatives": ~sat_detected & ~sntl_detected,
+    }
+    sums = {key: column[idx].sum(axis=1) for key, column in columns.items()}
+
+    bias, corr, rmse = metrics_from_sums(sums)
+    cm = [[sums["hits"], sums["false_alarms"]],
+          [sums["misses"], sums["correct_negatives"]]]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"bias": bias, "corr": corr, "rmse": rmse,
+                "pod": Statistics.POD(cm), "far": Statistics.FAR(cm),
+                "hss": Statistics.HSS(cm)}
+
+
+class StatisticsAccumulator:
+    """
+    Running counts and sums that the global statistics are calculated from.
+    It can be updated one match at a time, saved to a small json file and
+    merged with the accumulators of other shards or processes. Sums are kept
+    as exact partials so merging in any order gives the same result as one
+    accumulator over all matches. Sites get their own accumulator in sites
+    """
+    COUNTS = ("sfr_count", "swe_count", "n", "hits", "false_alarms", "misses", "correct_negatives")
+    SUMS = ("sfr_sum", "swe_sum", "x_sum", "y_sum", "xx_sum", "yy_sum", "xy_sum", "sq_err_sum")
+
+    def __init__(self, target_data: str, sat_thres=0.2, sntl_thres=2.54) -> None:
+        self.swe = target_data
+        self.sat_thres = sat_thres
+        self.sntl_thres = sntl_thres
+
+        self.counts = dict.fromkeys(self.COUNTS, 0)
+        self.partials = {key: [] for key in self.SUMS}
+        self.sites = {}  # dict of int|str:StatisticsAccumulator
+
+    def __add(self, key: str, x: float):
+        _add_partial(self.partials[key], float(x))
+
+    def update(self, sat, sntl, site_code=None):
+        """
+        Adds one collocated match. If site_code is given the match is also
+        added to the accumulator of that site
+        """
+        match = reduce_match(sat, sntl, self.swe)
+
+        for key in ("sfr_count", "swe_count", "n"):
+            self.counts[key] += match[key]
+        for key in ("sfr_sum", "swe_sum"):
+            self.__add(key, match[key])
+
+        if match["n"]:
+            x, y = match["x"], match["y"]
+            self.__add("x_sum", x)
+            self.__add("y_sum", y)
+            self.__add("xx_sum", x * x)
+            self.__add("yy_sum", y * y)
+            self.__add("xy_sum", x * y)
+            self.__add("sq_err_sum", (x - y)**2)
+
+        sat_detected = match["sfr_max"] > self.sat_thres
+        sntl_detected = match["swe_max"] > self.sntl_thres
+
+        if sat_detected and sntl_detected:
+            self.counts["hits"] += 1
+        elif sat_detected:
+            self.counts["false_alarms"] += 1
+        elif sntl_detected:
+            self.counts["misses"] += 1
+        else:
+            self.counts["correct_negatives"] += 1
+
+        if site_code is not None:
+            if site_code not in self.sites:
+                self.sites[site_code] = StatisticsAccumulator(self.swe, self.sat_thres, self.sntl_thres)
+            self.sites[site_code].update(sat, sntl)
+
+        return self
+
+    def update_site(self, site):
+        for sat, sntl in site:
+            self.update(sat, sntl, site.site_code)
+
+        return self
+
+    def update_dataset(self, coll):
+        for _, site in coll:
+            self.update_site(site)
+
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts and sums of another accumulator into this one
+        """
+        if (self.swe, self.sat_thres, self.sntl_thres) != (other.swe, other.sat_thres, other.sntl_thres):
+            raise ValueError("Can only merge accumulators of the same target data and thresholds")
+
+        for key in self.COUNTS:
+            self.counts[key] += other.counts[key]
+        for key in self.SUMS:
+            for x in other.partials[key]:
+                self.__add(key, x)
+
+        for code, site in other.sites.items():
+            if code not in self.sites:
+                self.sites[code] = StatisticsAccumulator(self.swe, self.sat_thres, self.sntl_thres)
+            self.sites[code].merge(site)
+
+        return self
+
+    def sums(self) -> dict:
+        sums = {key: math.fsum(partials) for key, partials in self.partials.items()}
+        sums.update(self.counts)
+
+        return sums
+
+    def bias(self) -> float:
+        return metrics_from_sums(self.sums())[0]
+
+    def correlation(self) -> float:
+        return metrics_from_sums(self.sums())[1]
+
+    def rmse(self) -> float:
+        return metrics_from_sums(self.sums())[2]
+
+    def confusion_matrix(self) -> list[list[int]]:
+        return [[self.counts["hits"], self.counts["false_alarms"]],
+                [self.counts["misses"], self.counts["correct_negatives"]]]
+
+    def __len__(self) -> int:
+        return sum(self.confusion_matrix()[0]) + sum(self.confusion_matrix()[1])
+
+    def to_dict(self) -> dict:
+        return {
+            "target_data": self.swe,
+            "sat_thres": self.sat_thres,
+            "sntl_thres": self.sntl_thres,
+            "counts": self.counts,
+            "partials": self.partials,
+            "sites": [[code, site.to_dict()] for code, site in self.sites.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        acc = cls(state["target_data"], state["sat_thres"], state["sntl_thres"])
+        acc.counts.update(state["counts"])
+        acc.partials.update(state["partials"])
+        acc.sites = {code: cls.from_dict(site) for code, site in state["sites"]}
+
+        return acc
+
+    def to_file(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def __add__(self, other):
+        return StatisticsAccumulator.from_dict(self.to_dict()).merge(other)
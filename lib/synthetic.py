@@ -0,0 +1,137 @@
+from lib import xr, np, pd, os, pickle
+from lib.snotel_data import SnotelDataset, SnotelSiteData
+
+"""
+Synthetic satellite granules and snotel data for testing and benchmarking
+without the real archives. Granules have the variables and attributes that
+FileReader.read_satellite_ncdf expects. Layouts follow the three cases of
+FileReader.read_all:
+    tiny: < 21 rows, a day is many granules that need to be built up (n20, npp)
+    normal: 20 to 700 rows, one granule covers the region
+    orbit: > 700 rows, full orbits that need to be localized (n19, moc, mob)
+"""
+
+LAYOUTS = {     # rows, cols, granules per day
+    "tiny": (12, 96, 300),
+    "normal": (180, 96, 6),
+    "orbit": (2250, 90, 2),
+}
+
+
+def write_granule(
+    path: str, rows: int, cols: int, start: str, first_row: tuple, row_step: tuple,
+    fov_step: tuple, scan_seconds: float=2.0, seed: int=0, missing: float=0.01
+):
+    """
+    Writes one granule. Pixel (r, c) is at first_row + r * row_step + 
+    (c - cols / 2) * fov_step where first_row is the (lon, lat) of the middle 
+    of the first scanline and steps are (lon, lat) degrees. A fraction missing
+    of the pixels has the -999 fill value
+    """
+    rng = np.random.default_rng(seed)
+    r = np.arange(rows)[:, None]
+    c = np.arange(cols)[None, :] - cols / 2
+
+    lon = first_row[0] + r * row_step[0] + c * fov_step[0] + rng.normal(0, 0.01, (rows, cols))
+    lat = first_row[1] + r * row_step[1] + c * fov_step[1] + rng.normal(0, 0.01, (rows, cols))
+    lon = (lon + 180) % 360 - 180
+    lat = np.clip(lat, -89.9, 89.9)
+
+    sfr = rng.gamma(0.5, 0.8, (rows, cols)) * (rng.random((rows, cols)) < 0.3)
+    sfr[rng.random((rows, cols)) < missing] = -999
+
+    time = pd.DatetimeIndex(np.datetime64(start) + (r[:, 0] * scan_seconds * 1000).astype("timedelta64[ms]"))
+    scan_time = lambda values, units=None: (("Scanline",), values.astype("int32"), {} if units is None else {"units": units})
+
+    ds = xr.Dataset(
+        {
+            "SFR": (("Scanline", "Field_of_view"), sfr.astype("float32")),
+            "Longitude": (("Scanline", "Field_of_view"), lon.astype("float32")),
+            "Latitude": (("Scanline", "Field_of_view"), lat.astype("float32")),
+            "ScanTime_year": scan_time(time.year.to_numpy()),
+            "ScanTime_month": scan_time(time.month.to_numpy()),
+            "ScanTime_dom": scan_time(time.day.to_numpy(), "days"),
+            "ScanTime_hour": scan_time(time.hour.to_numpy(), "hours"),
+            "ScanTime_minute": scan_time(time.minute.to_numpy(), "minutes"),
+            "ScanTime_second": scan_time(time.second.to_numpy(), "seconds"),
+        },
+        attrs={
+            "geospatial_first_scanline_first_fov_lon": float(lon[0, 0]),
+            "geospatial_first_scanline_last_fov_lon": float(lon[0, -1]),
+            "geospatial_first_scanline_first_fov_lat": float(lat[0, 0]),
+            "geospatial_first_scanline_last_fov_lat": float(lat[0, -1]),
+        },
+    )
+    ds.to_netcdf(path)
+
+
+def write_day(
+    folder: str, layout: str, day: str, center: tuple=(-150, 65), granules: int=None, seed: int=0
+) -> list[str]:
+    """
+    Writes the granules of one day in a layout into folder/YYYYMMDD. Overpasses
+    are spread over the day and each one crosses the center
+    """
+    rows, cols, n = LAYOUTS[layout]
+    n = n if granules is None else granules
+    day_folder = os.path.join(folder, day.replace("-", ""))
+    os.makedirs(day_folder, exist_ok=True)
+    paths = []
+
+    for i in range(n):
+        start = np.datetime64(day) + np.timedelta64(int(i * 86400 / n), "s")
+
+        if layout == "orbit":
+            # Ascending pass from the south pole to the north pole
+            first_row, row_step, fov_step = (center[0], -80.0), (0.0, 160 / rows), (0.25, 0.0)
+        elif layout == "normal":
+            # The first scanline crosses the center, tilted so it spans latitudes
+            first_row, row_step, fov_step = center, (0.05, -0.14), (0.3, 0.1)
+        else:
+            # Consecutive granules of passes, one pass crosses the center every
+            # 150 granules
+            offset = (i % 150) - 75
+            first_row, row_step, fov_step = ((center[0], center[1] + offset * rows * 0.14),
+                                             (-0.05, 0.14), (0.3, 0.1))
+
+        path = os.path.join(day_folder, f"{layout}_{str(start).replace(':', '')}.nc")
+        write_granule(path, rows, cols, str(start), first_row, row_step, fov_step,
+                      scan_seconds=8 / 3 if layout == "orbit" else 2.0, seed=seed + i)
+        paths.append(path)
+
+    return paths
+
+
+def make_sntl_dataset(
+    n_sites: int, date_range: tuple, center: tuple=(-150, 65), spread: float=3.0,
+    target_data: str="precip_accum_set_1", temp_data: str="air_temp_set_1", seed: int=0
+) -> SnotelDataset:
+    """
+    Snotel sites scattered around center with hourly accumulated precipitation
+    and temperature over the inclusive date range
+    """
+    rng = np.random.default_rng(seed)
+    sntl = SnotelDataset()
+    times = np.arange(np.datetime64(date_range[0], "h"), np.datetime64(date_range[1], "h") + 24)
+
+    for code in range(n_sites):
+        site = SnotelSiteData(code, f"Synthetic {code}", "AK", center[0] + rng.uniform(-spread, spread),
+                              center[1] + rng.uniform(-spread / 2, spread / 2), rng.uniform(100, 2500))
+        rate = rng.choice([0, 0, 0, 2.54, 5.08], len(times))
+        site.set_hourly_data(pd.DataFrame({
+            "Date_Time": times.astype("datetime64[ns]"),
+            target_data: np.cumsum(rate),
+            temp_data: rng.uniform(-25, 3, len(times)),
+        }))
+        sntl.add_site(code, site)
+
+    return sntl
+
+
+def write_sntl_pickle(path: str, *args, **kwargs) -> SnotelDataset:
+    sntl = make_sntl_dataset(*args, **kwargs)
+
+    with open(path, "wb") as f:
+        pickle.dump(sntl, f)
+
+    return sntl
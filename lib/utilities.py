@@ -47,6 +47,12 @@ def is_in_bounds(bounds: tuple | list, coords: tuple | list):
 
     return is_in
 
+def km_to_deg(lat, km):
+    MEAN_EARTH_RADIUS = 6371
+    r2 = MEAN_EARTH_RADIUS * np.cos(lat * (np.pi / 180))
+
+    return (km / r2) * (180 / np.pi)
+
 def hourly_swe_to_rate(sntl, target_data: str, type: str, new_col: bool=False):
     for _, site in sntl:
         if site.has_hourly_data() and target_data in site.hourly.columns:
@@ -109,29 +115,31 @@ def select_closest(df: pd.DataFrame, lon: float, lat: float) -> pd.DataFrame:
 def reduce_sat_df(df: pd.DataFrame, lon: float, lat: float):
     """
     Reduces sat data points that overlap in date time. Chooses the data point
-    that is closes to the station. Takes a datafame and the lon lat for the
-    station. Directly modifies inputted dataframe because we pd.drop
+    that is closes to the station, the first one on ties. Takes a datafame and
+    the lon lat for the station. Directly modifies inputted dataframe because
+    we pd.drop
     """
     re_site_lon = reformat_long(lon)
 
     if not df.empty:
-        for _, indices in df.groupby(["datetime"]).groups.items():
-            closest_point = None
-            closest_dist = np.inf
-
-            for index in indices:
-                re_sat_lon = reformat_long(df["longitude"][index])
-                dist = (
-                    (re_site_lon - re_sat_lon) ** 2 + (lat - df["latitude"][index]) ** 2
-                ) ** 0.5
-
-                if dist < closest_dist:
-                    closest_point = index
-                    closest_dist = dist
-
-            for index in indices:
-                if index != closest_point:
-                    df.drop(index, inplace=True)
+        sat_lon = df["longitude"].to_numpy(dtype=float)
+        re_sat_lon = np.where(sat_lon < 0, 360 + sat_lon, sat_lon)
+        dist = ((re_site_lon - re_sat_lon) ** 2 + (lat - df["latitude"].to_numpy(dtype=float)) ** 2) ** 0.5
+
+        # Sort by time group, then distance, then position: first of each group is closest
+        groups = pd.factorize(df["datetime"])[0]
+        order = np.lexsort((np.arange(len(df)), np.where(np.isnan(dist), np.inf, dist), groups))
+        is_first = np.r_[True, groups[order][1:] != groups[order][:-1]]
+
+        keep = groups == -1     # NaT is not in any group
+        keep[order[is_first]] = True
+        keep &= ~np.isnan(dist) | (groups == -1)
+
+        # ! pd.drop is by label, drop by position so duplicate labels are kept apart
+        index = df.index
+        df.reset_index(drop=True, inplace=True)
+        df.drop(np.flatnonzero(~keep), inplace=True)
+        df.index = index[keep]
 
 def select_closest_collocated_data(site: CollocatedSiteData):
     """